@@ -9,176 +9,1620 @@ bl_info = {
     "doc_url": "https://github.com/DanielTobs/SimpleSnap",
 }
 
+if "bpy" in locals():
+    import importlib
+    importlib.reload(snap_core)
+
 import bpy
-import bmesh
-from mathutils import Vector
-import random
+from bpy.app.handlers import persistent
+from mathutils import Matrix, Vector
+import numpy as np
+import cProfile
+import hashlib
+import os
+import time
+import weakref
+from collections import deque
+
+from . import snap_core
+from .snap_core import FootprintIndex, HeightField, SnapStats, TriangleSurface, footprint_bounds
+
+def gather_vectors(objects, attr):
+    """Read a 3-component property of every object into an (n, 3) array."""
+    values = np.empty(len(objects) * 3, dtype=np.float32)
+    if isinstance(objects, bpy.types.bpy_prop_collection):
+        objects.foreach_get(attr, values)
+    else:
+        values[:] = [component for obj in objects for component in getattr(obj, attr)]
+    return values.reshape(-1, 3)
+
+def scatter_vectors(objects, attr, values):
+    if isinstance(objects, bpy.types.bpy_prop_collection):
+        objects.foreach_set(attr, values.ravel())
+    else:
+        for obj, value in zip(objects, values.tolist()):
+            setattr(obj, attr, value)
+
+def gather_uids(objects):
+    uids = np.empty(len(objects), dtype=np.int32)
+    if isinstance(objects, bpy.types.bpy_prop_collection):
+        objects.foreach_get("session_uid", uids)
+    else:
+        uids[:] = [obj.session_uid for obj in objects]
+    return uids
+
+def gather_matrices(objects):
+    """Read matrix_world of every object into an (n, 4, 4) array of row-major matrices."""
+    if isinstance(objects, bpy.types.bpy_prop_collection):
+        values = np.empty(len(objects) * 16, dtype=np.float32)
+        objects.foreach_get("matrix_world", values)
+        # foreach_get hands out Blender's column-major storage
+        return values.reshape(-1, 4, 4).transpose(0, 2, 1)
+    return np.array([obj.matrix_world for obj in objects], dtype=np.float32).reshape(-1, 4, 4)
+
+def gather_corners(objects):
+    """Read the local bound_box of every object into an (n, 8, 3) array."""
+    values = np.empty(len(objects) * 24, dtype=np.float32)
+    if isinstance(objects, bpy.types.bpy_prop_collection):
+        objects.foreach_get("bound_box", values)
+    else:
+        values[:] = [component for obj in objects for corner in obj.bound_box for component in corner]
+    return values.reshape(-1, 8, 3)
+
+class WorldBoxCache:
+    """World-space bounding boxes by session UID, valid until the next depsgraph update moves something."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.rows = {}
+        self.boxes = np.empty((0, 6))
+
+    def discard(self, objects):
+        for uid in gather_uids(objects).tolist():
+            self.rows.pop(uid, None)
+
+    def get(self, objects):
+        """(n, 6) array of (min_x, min_y, min_z, max_x, max_y, max_z) rows, computing only uncached objects."""
+        uids = gather_uids(objects).tolist()
+        missing = [i for i, uid in enumerate(uids) if uid not in self.rows]
+        if missing:
+            subset = objects if len(missing) == len(uids) else [objects[i] for i in missing]
+            start = len(self.boxes)
+            self.boxes = np.vstack((self.boxes, snap_core.world_boxes(gather_corners(subset), gather_matrices(subset))))
+            for row, i in enumerate(missing, start):
+                self.rows[uids[i]] = row
+        return self.boxes[[self.rows[uid] for uid in uids]].reshape(-1, 6)
+
+world_box_cache = WorldBoxCache()
+
+@persistent
+def invalidate_world_boxes(scene, depsgraph):
+    if any(update.is_updated_transform or update.is_updated_geometry for update in depsgraph.updates):
+        world_box_cache.clear()
+
+@persistent
+def clear_world_boxes(*args):
+    # Frame changes move animated objects without a depsgraph_update_post
+    world_box_cache.clear()
+
+def local_offset(obj, dz):
+    """Location change that moves obj by dz along world Z, whatever space its location is in."""
+    if obj.parent is None:
+        return Vector((0, 0, dz))
+    space = obj.parent.matrix_world @ obj.matrix_parent_inverse
+    return space.to_3x3().inverted_safe() @ Vector((0, 0, dz))
+
+def selected_collection(context, selected_objects):
+    """Use the view layer's selection as a collection when it matches, so transforms move in bulk."""
+    collection = context.view_layer.objects.selected
+    if len(collection) == len(selected_objects) and set(collection) == set(selected_objects):
+        return collection
+    return selected_objects
+
+def footprint_index(objects, object_type, exclude=()):
+    entries = snap_core.box_entries(objects, world_box_cache.get(objects))
+    return FootprintIndex([entry for entry in entries
+                           if (object_type == 'ALL' or entry[0].type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'})
+                           and entry[0] not in exclude])
+
+def object_box(obj):
+    """Current world-space (min_x, max_x, min_y, max_y, min_z, max_z) of one object, bypassing the cache."""
+    box = snap_core.world_boxes(gather_corners([obj]), gather_matrices([obj]))
+    return tuple(snap_core.box_entries([obj], box)[0][1:])
+
+def content_hash(*parts):
+    """Hex digest of arrays, strings and numbers, used to name cached floor data after what it was built from."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"{part.dtype.str}{part.shape}".encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+class FloorDiskCache:
+    """Floor surfaces and height grids saved next to the .blend file and memory-mapped back in later sessions.
+
+    Files are named by a content hash of the arrays and transforms they were built from, so a changed floor simply
+    misses and its old files age out. Only actual floors are stored: target floors, floor collections and height
+    grids, not every object a ray happens to hit.
+    """
+
+    folder_name = ".simple_snap_cache"
+    # Least recently used files beyond this many are deleted
+    max_files = 256
+
+    def __init__(self):
+        # Set when files were written since the last prune
+        self.pending_prune = False
+
+    def directory(self):
+        """Folder of the cache, or None when it is turned off or the file was never saved."""
+        scene = bpy.context.scene
+        if scene is None or not scene.snap_disk_cache or not bpy.data.filepath:
+            return None
+        return os.path.join(os.path.dirname(bpy.data.filepath), self.folder_name)
+
+    def load(self, key):
+        directory = self.directory()
+        path = directory and os.path.join(directory, key + ".snap")
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            arrays = snap_core.map_arrays(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def store(self, key, arrays):
+        directory = self.directory()
+        if not directory:
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            snap_core.write_arrays(os.path.join(directory, key + ".snap"), arrays)
+            self.pending_prune = True
+        except OSError:
+            # A read-only or full disk only costs the speedup
+            pass
+
+    def prune(self):
+        """Delete the least recently used files beyond max_files, once per snap rather than once per file."""
+        directory = self.directory()
+        if not self.pending_prune or not directory:
+            return
+        self.pending_prune = False
+        try:
+            paths = [entry.path for entry in os.scandir(directory) if entry.name.endswith(".snap")]
+        except OSError:
+            return
+        if len(paths) <= self.max_files:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped by this session on some platforms
+                pass
+
+    def surface(self, key_parts, build, stats=None):
+        """TriangleSurface from the cache when it holds one for the parts' hash, otherwise built and saved.
+
+        key_parts is a callable, so the hash is only computed while the cache is on.
+        """
+        if self.directory() is None:
+            return build()
+        key = content_hash("surface", TriangleSurface.max_cells_per_axis, *key_parts())
+        arrays = self.load(key)
+        if arrays is not None:
+            if stats:
+                stats.count("disk_cache_hits")
+            surface = TriangleSurface.from_arrays(arrays)
+        else:
+            if stats:
+                stats.count("disk_cache_misses")
+            surface = build()
+            self.store(key, surface.arrays())
+        surface.cache_key = key
+        return surface
+
+    def heightfield(self, surface, resolution, stats=None):
+        """HeightField of a persisted floor's surface, from the cache when possible."""
+        if self.directory() is None:
+            return HeightField(surface, resolution)
+        key = getattr(surface, "cache_key", None) or content_hash(surface.vertices, surface.triangles)
+        key = content_hash("heightfield", key, resolution)
+        arrays = self.load(key)
+        if arrays is not None:
+            if stats:
+                stats.count("disk_cache_hits")
+            return HeightField.from_arrays(arrays)
+        if stats:
+            stats.count("disk_cache_misses")
+        field = HeightField(surface, resolution)
+        self.store(key, field.arrays())
+        return field
+
+floor_disk_cache = FloorDiskCache()
+
+class FloorGeometry:
+    """Triangles and face normals of a mesh datablock read in bulk, with a world-space surface per floor object."""
+
+    def __init__(self, mesh):
+        self.signature = FloorGeometry.mesh_signature(mesh)
+
+        self.co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", self.co)
+        self.co.shape = (-1, 3)
+
+        mesh.calc_loop_triangles()
+        self.triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("vertices", self.triangles)
+        self.triangles.shape = (-1, 3)
+        self.triangle_polygons = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+        mesh.loop_triangles.foreach_get("polygon_index", self.triangle_polygons)
+
+        self.polygon_normals = np.empty(len(mesh.polygons) * 3, dtype=np.float64)
+        mesh.polygons.foreach_get("normal", self.polygon_normals)
+        self.polygon_normals.shape = (-1, 3)
+
+        # Object pointer -> (matrix_world key, world-space TriangleSurface)
+        self.surfaces = {}
+        self._support_points = None
+        self._content_hash = None
+
+    @property
+    def content_hash(self):
+        """Hash of the geometry arrays, naming the surfaces built from them in the disk cache."""
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.co, self.triangles, self.triangle_polygons, self.polygon_normals)
+        return self._content_hash
+
+    @property
+    def support_points(self):
+        """Local vertices that can be the lowest point of the mesh in some orientation, shared by linked duplicates."""
+        if self._support_points is None:
+            self._support_points = self.co[snap_core.support_points(self.co)]
+        return self._support_points
+
+    @staticmethod
+    def mesh_signature(mesh):
+        return (len(mesh.vertices), len(mesh.edges), len(mesh.polygons), len(mesh.loops))
+
+    def surface(self, obj, stats=None, persist=False):
+        """World-space surface of one object using this geometry, kept in the disk cache as well with persist."""
+        matrix = obj.matrix_world
+        matrix_key = tuple(value for row in matrix for value in row)
+        cached = self.surfaces.get(obj.as_pointer())
+        if cached is not None and cached[0] == matrix_key:
+            if stats:
+                stats.count("surface_cache_hits")
+            return cached[1]
+        if stats:
+            stats.count("surface_cache_misses")
+
+        matrix = np.array(matrix_key).reshape(4, 4)
+        if persist:
+            surface = floor_disk_cache.surface(lambda: (self.content_hash, matrix),
+                                               lambda: TriangleSurface(*self.world_arrays(matrix)), stats)
+        else:
+            surface = TriangleSurface(*self.world_arrays(matrix))
+        self.surfaces[obj.as_pointer()] = (matrix_key, surface)
+        return surface
+
+    def world_arrays(self, m):
+        """(vertices, triangles, triangle normals) in world space for a row-major 4x4 world matrix."""
+        m = np.asarray(m, dtype=np.float64)
+        world_co = self.co @ m[:3, :3].T + m[:3, 3]
+
+        # Normals transform with the inverse transpose so non-uniform scale keeps them perpendicular
+        normals = self.polygon_normals @ np.linalg.inv(m[:3, :3])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        normals /= np.where(lengths > 0, lengths, 1)
+        return world_co, self.triangles, normals[self.triangle_polygons]
+
+# Mesh datablock pointer -> FloorGeometry
+_floor_geometry_cache = {}
+
+def floor_geometry(mesh, stats=None):
+    key = mesh.as_pointer()
+    geometry = _floor_geometry_cache.get(key)
+    if geometry is None or geometry.signature != FloorGeometry.mesh_signature(mesh):
+        geometry = _floor_geometry_cache[key] = FloorGeometry(mesh)
+        if stats:
+            stats.count("geometry_cache_misses")
+    elif stats:
+        stats.count("geometry_cache_hits")
+    return geometry
+
+@persistent
+def invalidate_floor_geometry(scene, depsgraph):
+    for update in depsgraph.updates:
+        if update.is_updated_geometry:
+            data = getattr(update.id.original, "data", update.id.original)
+            if isinstance(data, bpy.types.Mesh):
+                _floor_geometry_cache.pop(data.as_pointer(), None)
+            if isinstance(update.id, bpy.types.Object):
+                # Modifiers that read other objects or textures report their own object as re-evaluated too
+                _evaluated_geometry_cache.pop(update.id.original.as_pointer(), None)
+
+class MergedFloor:
+    """A floor collection treated as one floor, with a single world-space surface over all of its meshes."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.tolerance = 0.0
+        self.key = None
+        self.geometries = []
+        self.world_surface = None
+
+    def surface(self, stats=None, depsgraph=None):
+        """Merged surface, rebuilt when the collection's meshes, their geometry, transforms or the tolerance change."""
+        meshes = [obj for obj in self.collection.all_objects if obj.type == 'MESH']
+        matrices = gather_matrices(meshes)
+        geometries = [object_floor_geometry(obj, depsgraph, stats) for obj in meshes]
+        key = (self.tolerance, tuple(obj.as_pointer() for obj in meshes), matrices.tobytes())
+        if key == self.key and all(a is b for a, b in zip(geometries, self.geometries)):
+            if stats:
+                stats.count("surface_cache_hits")
+            return self.world_surface
+        if stats:
+            stats.count("surface_cache_misses")
+
+        self.world_surface = floor_disk_cache.surface(
+            lambda: (self.tolerance, matrices, *(geometry.content_hash for geometry in geometries)),
+            lambda: self.build(geometries, matrices), stats)
+        self.key = key
+        self.geometries = geometries
+        return self.world_surface
+
+    def build(self, geometries, matrices):
+        vertices, triangles, normals = [], [], []
+        offset = 0
+        for geometry, matrix in zip(geometries, matrices):
+            world_co, world_triangles, world_normals = geometry.world_arrays(matrix)
+            vertices.append(world_co)
+            triangles.append(world_triangles + offset)
+            normals.append(world_normals)
+            offset += len(world_co)
+        vertices = np.concatenate(vertices) if vertices else np.empty((0, 3))
+        triangles = np.concatenate(triangles) if triangles else np.empty((0, 3), dtype=np.int64)
+        normals = np.concatenate(normals) if normals else np.empty((0, 3))
+
+        if self.tolerance > 0:
+            # Coarse proxy for dense scans, its normals are recomputed from the merged triangles
+            vertices, triangles = snap_core.cluster_vertices(vertices, triangles, self.tolerance)
+            normals = None
+        return TriangleSurface(vertices, triangles, normals)
+
+    def members_under(self, bounds):
+        """Mesh objects of the collection whose footprint overlaps the (min_x, max_x, min_y, max_y, ...) bounds."""
+        meshes = [obj for obj in self.collection.all_objects if obj.type == 'MESH']
+        boxes = world_box_cache.get(meshes)
+        min_x, max_x, min_y, max_y = bounds[:4]
+        overlap = (boxes[:, 0] <= max_x) & (boxes[:, 3] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 4] >= min_y)
+        return [meshes[i] for i in np.flatnonzero(overlap).tolist()]
+
+# Collection pointer -> MergedFloor
+_merged_floor_cache = {}
+
+def merged_floor(collection, tolerance):
+    floor = _merged_floor_cache.get(collection.as_pointer())
+    if floor is None or floor.collection != collection:
+        floor = _merged_floor_cache[collection.as_pointer()] = MergedFloor(collection)
+    floor.tolerance = tolerance
+    return floor
+
+def snap_target(scene, snap_method):
+    """Return (target floor or None, objects to index as floors or None) for the scene's floor settings.
+
+    A floor collection becomes one MergedFloor for raycasts, and the set of indexed floors for bounds snapping.
+    """
+    if scene.enable_floor_selection:
+        collection = scene.target_floor_collection
+        if collection and snap_method != 'BOUNDS':
+            return merged_floor(collection, scene.snap_proxy_tolerance), None
+        if collection:
+            return None, collection.all_objects
+        if scene.target_floor_object:
+            return scene.target_floor_object, None
+    return None, scene.objects
+
+# Object pointer -> ((depsgraph pointer, frame), FloorGeometry of its evaluated mesh). Entries are dropped by
+# invalidate_floor_geometry when the object is re-evaluated.
+_evaluated_geometry_cache = {}
+
+def evaluated_floor_geometry(obj, depsgraph, stats=None):
+    """FloorGeometry of the object's evaluated mesh, extracted once per depsgraph update that touches the object.
+
+    After a frame change the mesh is extracted again, but the cached geometry is kept when the vertices match.
+    """
+    state = (depsgraph.as_pointer(), depsgraph.scene.frame_current)
+    cached = _evaluated_geometry_cache.get(obj.as_pointer())
+    if cached is not None and cached[0] == state:
+        if stats:
+            stats.count("geometry_cache_hits")
+        return cached[1]
+
+    evaluated = obj.evaluated_get(depsgraph)
+    mesh = evaluated.to_mesh()
+    try:
+        if stats:
+            stats.count("evaluated_meshes")
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+        geometry = cached[1] if cached is not None else None
+        if (geometry is not None and geometry.signature == FloorGeometry.mesh_signature(mesh)
+                and np.array_equal(geometry.co.ravel(), co)):
+            if stats:
+                stats.count("geometry_cache_hits")
+        else:
+            if stats:
+                stats.count("geometry_cache_misses")
+            geometry = FloorGeometry(mesh)
+        _evaluated_geometry_cache[obj.as_pointer()] = (state, geometry)
+        return geometry
+    finally:
+        evaluated.to_mesh_clear()
+
+def object_floor_geometry(obj, depsgraph=None, stats=None):
+    """FloorGeometry of what the object renders: its evaluated mesh when it has modifiers or shape keys.
+
+    Plain meshes share one FloorGeometry between linked duplicates, so they are read from the datablock.
+    """
+    if depsgraph is None or not (obj.modifiers or obj.data.shape_keys):
+        return floor_geometry(obj.data, stats)
+    return evaluated_floor_geometry(obj, depsgraph, stats)
+
+# World-space surface -> {resolution: HeightField, or None when the surface is not a terrain}. Surfaces are rebuilt
+# whenever their mesh or transform changes, so the grids go away with them.
+_heightfield_cache = weakref.WeakKeyDictionary()
+
+# Surfaces with fewer triangles are raycast directly. Rugs, decals and table tops pass HeightField.suitable, but
+# rasterizing each of them costs far more than the few rays they receive.
+HEIGHTFIELD_MIN_TRIANGLES = 4096
+
+def heightfield_surface(surface, resolution, stats=None, persist=False):
+    """The surface rasterized into a HeightField of the given resolution, or the surface itself if it is no terrain.
+
+    Only persist keeps the grid in the disk cache, so props that move between snaps don't fill it with one file per
+    position.
+    """
+    fields = _heightfield_cache.setdefault(surface, {})
+    if resolution not in fields:
+        terrain = len(surface.triangles) >= HEIGHTFIELD_MIN_TRIANGLES and HeightField.suitable(surface)
+        if stats and terrain:
+            stats.count("heightfield_builds")
+        if not terrain:
+            fields[resolution] = None
+        elif persist:
+            fields[resolution] = floor_disk_cache.heightfield(surface, resolution, stats)
+        else:
+            fields[resolution] = HeightField(surface, resolution)
+    return fields[resolution] or surface
+
+@persistent
+def clear_floor_caches(*args):
+    # Opening or reverting a file frees every datablock, and new ones can reuse the old pointers with the same
+    # element counts, so nothing keyed by pointer is trusted past a load
+    _floor_geometry_cache.clear()
+    _evaluated_geometry_cache.clear()
+    _merged_floor_cache.clear()
+    _heightfield_cache.clear()
+    world_box_cache.clear()
+
+def floor_surface(floor, stats=None, depsgraph=None, heightfield=0, persist=False):
+    """World-space surface of a floor, with modifiers applied when a depsgraph is given.
+
+    With a heightfield resolution, terrain floors are answered from a cached height grid instead of their triangles.
+    persist keeps an object floor and its height grid in the disk cache, for the target floor; floor collections
+    always are.
+    """
+    if isinstance(floor, MergedFloor):
+        surface = floor.surface(stats, depsgraph)
+        persist = True
+    else:
+        surface = object_floor_geometry(floor, depsgraph, stats).surface(floor, stats, persist)
+    if heightfield:
+        return heightfield_surface(surface, heightfield, stats, persist)
+    return surface
+
+def raycast_candidates(obj, bounds, origin_z, floor_index, target_floor, distance_limit):
+    """Mesh floors a downward ray from the object could hit."""
+    if isinstance(target_floor, MergedFloor):
+        # A member of the floor collection would land on its own triangles
+        return [] if obj.name in target_floor.collection.all_objects else [target_floor]
+    if target_floor:
+        floors = [target_floor]
+    else:
+        min_x, max_x, min_y, max_y, bottom_z = bounds
+        floors = [entry[0] for entry in floor_index.query(min_x, max_x, min_y, max_y,
+                                                           bottom_z - distance_limit, origin_z)]
+    return [floor for floor in floors if floor != obj and floor.type == 'MESH']
+
+def floor_normal_below(floor, location, triangle_index=None, depsgraph=None, heightfield=0):
+    """Normal of the floor face under location, or of the topmost face below its XY if the index is unknown.
+
+    The heightfield resolution has to match the one the index came from, since grid cells index a HeightField.
+    """
+    if not isinstance(floor, MergedFloor) and floor.type != 'MESH':
+        return None
+    surface = floor_surface(floor, depsgraph=depsgraph, heightfield=heightfield)
+    if triangle_index is None or triangle_index < 0:
+        low, high = surface.bounds
+        triangle_index = surface.drop([location[0]], [location[1]], high[2], high[2] - low[2] + 1)[1][0]
+        if triangle_index < 0:
+            return None
+    return Vector(surface.normals[triangle_index])
+
+def geometry_median(data):
+    """Mean of the vertices, curve points or bone ends of object data in local space, or None when empty."""
+    if isinstance(data, bpy.types.Mesh):
+        chunks = [(data.vertices, "co", 3)]
+    elif isinstance(data, bpy.types.Curve):
+        chunks = [(spline.bezier_points, "co", 3) if spline.type == 'BEZIER' else (spline.points, "co", 4)
+                  for spline in data.splines]
+    elif isinstance(data, bpy.types.Armature):
+        chunks = [(data.bones, "head_local", 3), (data.bones, "tail_local", 3)]
+    else:
+        return None
+
+    total = Vector((0, 0, 0))
+    count = 0
+    for collection, attr, width in chunks:
+        if not len(collection):
+            continue
+        co = np.empty(len(collection) * width, dtype=np.float32)
+        collection.foreach_get(attr, co)
+        total += Vector(co.reshape(-1, width)[:, :3].sum(axis=0, dtype=np.float64))
+        count += len(collection)
+    return total / count if count else None
+
+def clear_object_transform(data, users):
+    """Bake the users' shared basis matrix into data and put their origin at the geometry median."""
+    basis = users[0].matrix_basis.copy()
+    median = geometry_median(data)
+    center = basis @ median if median is not None else Vector((0, 0, 0))
+
+    matrix = Matrix.Translation(-center) @ basis
+    if isinstance(data, bpy.types.Mesh):
+        data.transform(matrix, shape_keys=True)
+        if matrix.is_negative:
+            data.flip_normals()
+    else:
+        data.transform(matrix)
+
+    new_basis = Matrix.Translation(center)
+    # Children keep their world transform, the same way transform_apply compensates them
+    correction = new_basis.inverted_safe() @ basis
+    for obj in users:
+        obj.matrix_basis = new_basis
+        for child in obj.children:
+            child.matrix_parent_inverse = correction @ child.matrix_parent_inverse
+
+def clear_transforms(objects):
+    """Apply location, rotation and scale to object data and set origins to geometry, without operators."""
+    users_by_data = {}
+    for obj in objects:
+        if obj.type in {'MESH', 'CURVE', 'ARMATURE'}:
+            users_by_data.setdefault(obj.data, []).append(obj)
+
+    for data, users in users_by_data.items():
+        first_basis = users[0].matrix_basis
+        if data.users == len(users) and all(obj.matrix_basis == first_basis for obj in users[1:]):
+            clear_object_transform(data, users)
+            continue
+
+        # Users need different results, so each gets its own copy of the data
+        for obj in users:
+            if obj.data.users > 1:
+                obj.data = obj.data.copy()
+            clear_object_transform(obj.data, [obj])
+
+def contact_points(objects, boxes, stats=None):
+    """World-space support points of objects, with the row of the object each point belongs to.
+
+    Meshes use the support set cached on their mesh data, other objects the bottom center of their box.
+    """
+    points = []
+    owners = []
+    for row, (obj, matrix, box) in enumerate(zip(objects, gather_matrices(objects), boxes.tolist())):
+        if obj.type == 'MESH' and len(obj.data.vertices):
+            local = floor_geometry(obj.data, stats).support_points
+            points.append(local @ matrix[:3, :3].T + matrix[:3, 3])
+        else:
+            points.append(np.array([[(box[0] + box[3]) / 2, (box[1] + box[4]) / 2, box[2]]]))
+        owners.append(np.full(len(points[-1]), row))
+    if not points:
+        return np.empty((0, 3)), np.empty(0, dtype=np.int64)
+    return np.concatenate(points), np.concatenate(owners)
+
+def find_support(obj, bounds, origin, half_z, floor_index, target_floor, snap_method, distance_limit,
+                 depsgraph=None):
+    """Return (floor, surface Z, triangle index or None) for the object's bounds, or None if nothing is below."""
+    if snap_method in {'RAYCAST', 'CONTACT'}:
+        floors = raycast_candidates(obj, bounds, origin[2], floor_index, target_floor, distance_limit)
+        surfaces = {floor: floor_surface(floor, depsgraph=depsgraph, persist=floor == target_floor) for floor in floors}
+        if snap_method == 'CONTACT':
+            box = np.array([[bounds[0], bounds[2], bounds[4], bounds[1], bounds[3], origin[2] + half_z]])
+            points, owners = contact_points([obj], box)
+            supports, hit_floors, triangles = snap_core.contact_supports(surfaces, [floors], points, owners, box[:, 2],
+                                                                         [origin[2]], half_z + distance_limit)
+        else:
+            supports, hit_floors, triangles = snap_core.surface_supports(surfaces, [floors], [origin],
+                                                                         half_z + distance_limit)
+        if hit_floors[0] is not None:
+            return hit_floors[0], float(supports[0]), int(triangles[0])
+    elif target_floor:
+        return target_floor, object_box(target_floor)[5], None
+    else:
+        # Find the closest object below
+        entry = floor_index.closest_below(obj, bounds, distance_limit)
+        if entry:
+            return entry[0], entry[6], None
+    return None
+
+class SnapHistory:
+    """Bounded ring buffer of snap batches, each holding session UIDs and packed location, rotation and scale.
+
+    Batches that created controls also keep the controls' UIDs and the parent each child had before.
+    """
+
+    max_batches = 32
+    attributes = ("location", "rotation_euler", "scale")
+
+    def __init__(self):
+        self.batches = deque(maxlen=self.max_batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def record(self, objects):
+        # Session UIDs survive renames and Blender's own undo steps, unlike names or Python references
+        batch = {
+            "uids": gather_uids(objects),
+            "transforms": np.hstack([gather_vectors(objects, attr) for attr in self.attributes]),
+            "controls": [],
+            # Child UID -> (parent UID or None, matrix_parent_inverse rows) from before the controls took over
+            "parents": {},
+        }
+        self.batches.append(batch)
+        return batch
+
+    def restore(self):
+        """Pop the latest batch, remove its control empties and write the stored transforms back in bulk."""
+        batch = self.batches.pop()
+        objects = bpy.data.objects
+
+        if batch["controls"]:
+            uids = gather_uids(objects)
+            by_uid = dict(zip(uids.tolist(), objects))
+            for control_empty in [objects[int(i)] for i in np.flatnonzero(np.isin(uids, batch["controls"]))]:
+                for child in control_empty.children:
+                    # The stored transforms are relative to the old parent, so it has to be back before they are
+                    parent_uid, parent_inverse = batch["parents"].get(child.session_uid, (None, None))
+                    child.parent = by_uid.get(parent_uid)
+                    if parent_inverse is not None:
+                        child.matrix_parent_inverse = Matrix(parent_inverse)
+                objects.remove(control_empty)
+
+        all_uids = gather_uids(objects)
+        if not len(all_uids):
+            return 0
+        order = np.argsort(all_uids)
+        positions = np.minimum(np.searchsorted(all_uids, batch["uids"], sorter=order), len(order) - 1)
+        rows = order[positions]
+        found = all_uids[rows] == batch["uids"]
+        rows = rows[found]
+
+        for column, attr in enumerate(self.attributes):
+            values = gather_vectors(objects, attr)
+            values[rows] = batch["transforms"][found, column * 3:column * 3 + 3]
+            scatter_vectors(objects, attr, values)
+        return len(rows)
+
+snap_history = SnapHistory()
+
+class AutoSnapState:
+    """Caches kept between depsgraph updates so auto snap only touches what actually moved."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.index = None
+        self.index_key = None
+        self.matrices = {}
+        # Locations auto snap wrote itself, so the update they cause can be recognised and ignored
+        self.written = {}
+        # Floor object, or floor collection member, -> objects that were snapped onto it
+        self.dependents = {}
+        self.busy = False
+
+    def floor_index(self, scene, floor_objects):
+        # floor_objects is the scene's or a floor collection's objects, id_data tells them apart
+        index_key = (floor_objects.id_data.as_pointer(), len(floor_objects), scene.snap_object_type)
+        if self.index is None or self.index_key != index_key:
+            self.index = footprint_index(floor_objects, scene.snap_object_type)
+            self.index_key = index_key
+        return self.index
+
+    def changed_objects(self, depsgraph):
+        changed = []
+        for update in depsgraph.updates:
+            if not update.is_updated_transform or not isinstance(update.id, bpy.types.Object):
+                continue
+            obj = update.id.original
+            matrix_key = tuple(value for row in obj.matrix_world for value in row)
+            if self.matrices.get(obj) == matrix_key:
+                continue
+            self.matrices[obj] = matrix_key
+            if self.written.pop(obj, None) == tuple(obj.location):
+                continue
+            changed.append(obj)
+        return changed
+
+    def snap(self, scene, changed, depsgraph):
+        target_floor, floor_objects = snap_target(scene, scene.snap_method)
+        floor_index = None if target_floor else self.floor_index(scene, floor_objects)
+        index_all = scene.snap_object_type == 'ALL'
+
+        queue = []
+        for obj in changed:
+            if (floor_index and (index_all or obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'})
+                    and obj.name in floor_objects):
+                floor_index.update(obj, object_box(obj))
+            if obj.select_get() and obj != target_floor:
+                queue.append(obj)
+            queue.extend(self.dependents.pop(obj, ()))
+
+        moved_boxes = {}
+        visited = set()
+        while queue:
+            obj = queue.pop()
+            if obj in visited or obj.type not in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}:
+                continue
+            visited.add(obj)
+
+            # matrix_world lags behind locations written earlier in this pass, so use the moved box if there is one
+            box = moved_boxes.get(obj) or object_box(obj)
+            center = ((box[0] + box[1]) / 2, (box[2] + box[3]) / 2, (box[4] + box[5]) / 2)
+            half_z = (box[5] - box[4]) / 2
+            support = find_support(obj, box[:5], center, half_z, floor_index, target_floor,
+                                   scene.snap_method, scene.snap_detection_distance_limit, depsgraph)
+            if support is None:
+                continue
+
+            floor, support_z, triangle_index = support
+            # A floor collection is keyed by its members, since those are what the depsgraph reports as moved
+            for member in floor.members_under(box) if isinstance(floor, MergedFloor) else [floor]:
+                self.dependents.setdefault(member, set()).add(obj)
+            dz = snap_core.landing_heights(support_z, half_z, scene.snap_gap_offset) - center[2]
+            if abs(dz) > 1e-6:
+                obj.location += local_offset(obj, dz)
+                self.written[obj] = tuple(obj.location)
+                box = moved_boxes[obj] = box[:4] + (box[4] + dz, box[5] + dz)
+                if floor_index and obj.name in floor_objects:
+                    floor_index.update(obj, box)
+                # Whatever rests on this object has to follow it
+                queue.extend(self.dependents.pop(obj, ()))
+
+            if scene.snap_rotate_to_normal and obj.type == 'MESH':
+                face_normal = floor_normal_below(floor, center, triangle_index, depsgraph)
+                if face_normal is not None:
+                    obj.rotation_euler = face_normal.to_track_quat('Z', 'Y').to_euler()
+
+_auto_snap = AutoSnapState()
+
+@persistent
+def auto_snap(scene, depsgraph):
+    if not scene.snap_auto or _auto_snap.busy:
+        return
+    changed = _auto_snap.changed_objects(depsgraph)
+    if not changed:
+        return
+
+    _auto_snap.busy = True
+    try:
+        _auto_snap.snap(scene, changed, depsgraph)
+    except ReferenceError:
+        # Objects were removed since the caches were filled
+        _auto_snap.reset()
+    finally:
+        _auto_snap.busy = False
+
+@persistent
+def reset_auto_snap(*args):
+    _auto_snap.reset()
+
+class SnapJob:
+    """One snap with the scene's settings, run over the objects in one go or in several chunks.
+
+    Random rotations and the floor index are set up once for all objects, so chunks can be snapped one after the
+    other, for instance from a modal timer.
+    """
+
+    # Names listed in the warning about objects that found nothing below
+    max_reported_names = 5
+
+    def __init__(self, context, objects_to_snap, stats, randomize=True, depsgraph=None):
+        scene = context.scene
+        self.stats = stats
+        self.distance_limit = scene.snap_detection_distance_limit
+        self.gap_offset = scene.snap_gap_offset
+        self.rotate_to_normal = scene.snap_rotate_to_normal
+        self.snap_method = scene.snap_method
+        self.stack = scene.snap_stack
+        self.footprint_samples = scene.snap_footprint_samples
+        self.footprint_combine = scene.snap_footprint_combine
+        self.avoid_overlaps = scene.snap_avoid_overlaps
+        # Height grid resolution for terrain floors, 0 to raycast their triangles
+        self.heightfield = scene.snap_heightfield_resolution if scene.snap_heightfield else 0
+        self.target_floor, floor_objects = snap_target(scene, self.snap_method)
+        self.objects = 0
+        self.snapped = 0
+        self.missed = []
+        # Set when the objects are snapped in several runs that should see each other's results
+        self.chunked = False
+        # Floors with modifiers are read from this depsgraph's evaluated meshes
+        self.depsgraph = depsgraph or context.evaluated_depsgraph_get()
+
+        rotate_randomly = (scene.snap_randomize_rotation_x, scene.snap_randomize_rotation_y,
+                           scene.snap_randomize_rotation_z)
+        if randomize and any(rotate_randomly):
+            with stats.phase("gather"):
+                # The new rotations change the world bounds, so they are applied before anything is measured
+                snappable = np.array([obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'} for obj in objects_to_snap],
+                                     dtype=bool)
+                rotations = gather_vectors(objects_to_snap, "rotation_euler")
+                snap_core.randomize_rotations(rotations, snappable, rotate_randomly)
+                scatter_vectors(objects_to_snap, "rotation_euler", rotations)
+                context.view_layer.update()
+                world_box_cache.discard(objects_to_snap)
+
+        # Objects left where they are that snapped objects must not intersect, without the target floor
+        self.obstacles = []
+        # Objects settled by earlier runs of a chunked snap, as (objects, boxes, points, owners, surfaces)
+        self.settled = []
+        # Boxes and objects settled by earlier runs of a chunked stacking snap, for later chunks to stack onto
+        self.stacked_boxes = np.empty((0, 6))
+        self.stacked_objects = []
+        if self.avoid_overlaps:
+            selected = set(objects_to_snap)
+            if isinstance(self.target_floor, MergedFloor):
+                selected.update(self.target_floor.collection.all_objects)
+            self.obstacles = [obj for obj in context.view_layer.objects
+                              if obj.type in {'MESH', 'CURVE'} and obj not in selected and obj != self.target_floor]
+
+        self.floor_index = None
+        if not self.target_floor:
+            with stats.phase("index"):
+                # When stacking, the selection settles onto itself below, so it is left out of the floors
+                exclude = set(objects_to_snap) if self.stack else ()
+                self.floor_index = footprint_index(floor_objects, scene.snap_object_type, exclude=exclude)
+
+    def run(self, objects_to_snap):
+        """Snap a list or collection of objects and write their new transforms."""
+        stats = self.stats
+        distance_limit = self.distance_limit
+        gap_offset = self.gap_offset
+        snap_method = self.snap_method
+        target_floor = self.target_floor
+        floor_index = self.floor_index
+
+        # Gather every transform up front and write the results back in one go
+        with stats.phase("gather"):
+            objects = list(objects_to_snap)
+            snappable = np.array([obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'} for obj in objects], dtype=bool)
+            locations = gather_vectors(objects_to_snap, "location")
+            rotations = gather_vectors(objects_to_snap, "rotation_euler")
+            boxes = world_box_cache.get(objects_to_snap)
+            centers = (boxes[:, :3] + boxes[:, 3:]) / 2
+            half = (boxes[:, 3:] - boxes[:, :3]) / 2
+
+        # Z of the surface each object lands on, NaN where nothing was found
+        supports = np.full(len(objects), np.nan)
+        floors = [None] * len(objects)
+        triangles = np.full(len(objects), -1)
+        # Normals of planes fitted through footprint hits, NaN where the floor face normal applies
+        plane_normals = np.full((len(objects), 3), np.nan)
+        rows = np.flatnonzero(snappable)
+
+        with stats.phase("search"):
+            if snap_method == 'BOUNDS' and target_floor:
+                supports[snappable] = world_box_cache.get([target_floor])[0, 5]
+                floors = [target_floor] * len(objects)
+            elif snap_method == 'BOUNDS':
+                bounds = footprint_bounds(boxes)
+                for i in rows.tolist():
+                    # Find the closest object below
+                    entry = floor_index.closest_below(objects[i], bounds[i], distance_limit)
+                    if entry:
+                        floors[i] = entry[0]
+                        supports[i] = entry[6]
+            else:
+                bounds = footprint_bounds(boxes)
+                candidates = [raycast_candidates(objects[i], bounds[i], float(centers[i, 2]), floor_index,
+                                                 target_floor, distance_limit) for i in rows.tolist()]
+                surfaces = {floor: floor_surface(floor, stats, self.depsgraph, self.heightfield, floor == target_floor)
+                            for floor_list in candidates for floor in floor_list}
+                if snap_method == 'CONTACT':
+                    with stats.phase("contact_points"):
+                        points, owners = contact_points([objects[i] for i in rows.tolist()], boxes[rows], stats)
+                    point_counts = np.bincount(owners, minlength=len(rows))
+                    stats.count("rays_cast", int(sum(len(floor_list) * count for floor_list, count
+                                                     in zip(candidates, point_counts.tolist()))))
+                    supports[rows], hit_floors, triangles[rows] = snap_core.contact_supports(
+                        surfaces, candidates, points, owners, boxes[rows, 2], centers[rows, 2],
+                        half[rows, 2] + distance_limit)
+                elif self.footprint_samples > 1:
+                    stats.count("rays_cast", sum(len(floor_list) for floor_list in candidates)
+                                * self.footprint_samples ** 2)
+                    supports[rows], hit_floors, triangles[rows], plane_normals[rows] = snap_core.footprint_supports(
+                        surfaces, candidates, boxes[rows], self.footprint_samples, half[rows, 2] + distance_limit,
+                        self.footprint_combine, level=not self.rotate_to_normal)
+                else:
+                    stats.count("rays_cast", sum(len(floor_list) for floor_list in candidates))
+                    supports[rows], hit_floors, triangles[rows] = snap_core.surface_supports(
+                        surfaces, candidates, centers[rows], half[rows, 2] + distance_limit)
+                for i, floor in zip(rows.tolist(), hit_floors):
+                    floors[i] = floor
+
+        if self.stack and len(rows):
+            with stats.phase("stack"):
+                # Only the boxes settled by earlier chunks that overlap one of this chunk's are worth passing on
+                first, second = snap_core.sweep_and_prune(np.vstack((boxes[rows], self.stacked_boxes)),
+                                                          np.arange(len(rows) + len(self.stacked_boxes)) < len(rows))
+                nearby = np.unique(np.concatenate((first, second)))
+                nearby = nearby[nearby >= len(rows)] - len(rows)
+                supports[rows], support_rows = snap_core.stack_supports(boxes[rows], supports[rows], distance_limit,
+                                                                        gap_offset, self.stacked_boxes[nearby])
+                for i, row in zip(rows.tolist(), support_rows.tolist()):
+                    if row >= len(rows):
+                        floors[i] = self.stacked_objects[nearby[row - len(rows)]]
+                        triangles[i] = -1
+                    elif row >= 0:
+                        floors[i] = objects[rows[row]]
+                        triangles[i] = -1
+
+        with stats.phase("place"):
+            landed = ~np.isnan(supports)
+            offsets = np.zeros(len(objects))
+            offsets[landed] = snap_core.landing_heights(supports[landed], half[landed, 2], gap_offset) - centers[landed, 2]
+
+        if self.avoid_overlaps:
+            with stats.phase("overlaps"):
+                moved = np.flatnonzero(landed & snappable)
+                offsets[moved] += self.overlap_lifts(objects, moved, boxes, offsets, floors)
+
+        with stats.phase("place"):
+            unparented = np.array([obj.parent is None for obj in objects], dtype=bool)
+            locations[unparented, 2] += offsets[unparented]
+            # Parented locations live in the parent's space, so the world offset has to be carried into it
+            for i in np.flatnonzero(landed & ~unparented).tolist():
+                locations[i] += local_offset(objects[i], offsets[i])
+
+            if self.stack and self.chunked:
+                # Later chunks stack onto the objects settled by this one
+                self.stacked_boxes = np.vstack((self.stacked_boxes,
+                                                boxes[rows] + offsets[rows, None] * (0, 0, 1, 0, 0, 1)))
+                self.stacked_objects += [objects[i] for i in rows.tolist()]
+
+        if self.rotate_to_normal:
+            with stats.phase("normals"):
+                for i in np.flatnonzero(landed).tolist():
+                    if objects[i].type == 'MESH':
+                        if not np.isnan(plane_normals[i, 0]):
+                            face_normal = Vector(plane_normals[i])
+                        else:
+                            face_normal = floor_normal_below(floors[i], centers[i], triangles[i], self.depsgraph,
+                                                                 self.heightfield)
+
+                        if face_normal is not None:
+                            rot = face_normal.to_track_quat('Z', 'Y')
+                            rotations[i] = rot.to_euler()
+
+        with stats.phase("write"):
+            scatter_vectors(objects_to_snap, "location", locations)
+            if self.rotate_to_normal:
+                scatter_vectors(objects_to_snap, "rotation_euler", rotations)
+            world_box_cache.discard(objects_to_snap)
+
+        self.objects += len(objects)
+        self.snapped += int(landed.sum())
+        self.missed += [obj.name for obj, is_snappable, has_landed in zip(objects, snappable.tolist(), landed.tolist())
+                        if is_snappable and not has_landed]
+
+    def overlap_lifts(self, objects, rows, boxes, offsets, floors):
+        """Extra Z offsets for the rows so they do not intersect each other or nearby obstacles.
+
+        A sweep and prune over the boxes finds the pairs worth testing, then support points are dropped onto the
+        other object's surface to tell real intersections from overlapping boxes. Objects never intersect the floor
+        they were snapped onto.
+        """
+        stats = self.stats
+        moved = [objects[i] for i in rows.tolist()]
+        moved_boxes = boxes[rows] + offsets[rows, None] * (0, 0, 1, 0, 0, 1)
+        points, owners = contact_points(moved, boxes[rows], stats)
+        points[:, 2] += offsets[rows][owners]
+
+        obstacle_boxes = world_box_cache.get(self.obstacles)
+        if len(moved_boxes):
+            low, high = moved_boxes[:, :3].min(axis=0), moved_boxes[:, 3:].max(axis=0)
+            near = np.flatnonzero(np.all(obstacle_boxes[:, :3] <= high, axis=1)
+                                  & np.all(obstacle_boxes[:, 3:] >= low, axis=1))
+        else:
+            near = np.empty(0, dtype=np.int64)
+        obstacles = [self.obstacles[i] for i in near.tolist()]
+        obstacle_points, obstacle_owners = contact_points(obstacles, obstacle_boxes[near], stats)
+
+        # Rows: this run's objects, then nearby obstacles, then what earlier chunks settled
+        participants = moved + obstacles
+        all_boxes = [moved_boxes, obstacle_boxes[near]]
+        all_points = [points, obstacle_points]
+        all_owners = [owners, obstacle_owners + len(moved)]
+        surfaces = {}
+        for settled_objects, settled_boxes, settled_points, settled_owners, settled_surfaces in self.settled:
+            start = len(participants)
+            participants += settled_objects
+            all_boxes.append(settled_boxes)
+            all_points.append(settled_points)
+            all_owners.append(settled_owners + start)
+            surfaces.update({start + row: surface for row, surface in settled_surfaces.items()})
+        all_boxes = np.concatenate(all_boxes)
+        movable = np.arange(len(participants)) < len(moved)
+
+        first, second = snap_core.sweep_and_prune(all_boxes, movable)
+        floor_of = [floors[i] for i in rows.tolist()]
+        keep = [not ((a < len(moved) and floor_of[a] == participants[b])
+                     or (b < len(moved) and floor_of[b] == participants[a]))
+                for a, b in zip(first.tolist(), second.tolist())]
+        first, second = first[keep], second[keep]
+        stats.count("overlap_pairs", len(first))
 
-class SnapToGroundOperator(bpy.types.Operator):
+        for row in np.unique(np.concatenate((first, second))).tolist():
+            obj = participants[row]
+            if row not in surfaces and obj.type == 'MESH':
+                # Surfaces are built where the objects were before this snap moved them
+                surfaces[row] = (floor_surface(obj, stats, self.depsgraph), offsets[rows[row]] if movable[row] else 0.0)
+
+        lifts = snap_core.resolve_overlaps(all_boxes, movable, (first, second), np.concatenate(all_points),
+                                           np.concatenate(all_owners), surfaces)[:len(moved)]
+
+        if self.chunked:
+            lifted_points = points + (0, 0, 1) * lifts[owners, None]
+            self.settled.append((moved, moved_boxes + lifts[:, None] * (0, 0, 1, 0, 0, 1), lifted_points, owners,
+                                 {row: (surfaces[row][0], surfaces[row][1] + lifts[row])
+                                  for row in range(len(moved)) if row in surfaces}))
+        return lifts
+
+    def report(self, operator):
+        """Record the totals in the stats and emit one summary line, plus one warning for missed objects."""
+        stats = self.stats
+        floor_disk_cache.prune()
+        if self.floor_index:
+            stats.count("candidates_tested", self.floor_index.tested)
+        stats.count("objects", self.objects)
+        stats.count("snapped", self.snapped)
+        operator.report({'INFO'}, f"Snapped {self.snapped} of {self.objects} objects with Gap Offset "
+                                  f"{self.gap_offset} in {stats.total * 1000:.1f} ms")
+        if self.missed:
+            names = ", ".join(self.missed[:self.max_reported_names])
+            if len(self.missed) > self.max_reported_names:
+                names += f" and {len(self.missed) - self.max_reported_names} more"
+            operator.report({'WARNING'}, f"No closest object found below for {names}.")
+
+class SnapSetup:
+    """Preparation shared by the snap operators, before the objects themselves are snapped."""
+
+    def prepare(self, context, stats):
+        """Clear transforms, record the undo batch and create controls, returning the objects to snap."""
+        selected_objects = context.selected_objects
+        control_empty = next((obj for obj in selected_objects if obj.type == 'EMPTY'), None)
+
+        if context.scene.clear_mesh:
+            with stats.phase("clear_mesh"):
+                clear_transforms(selected_objects)
+                context.view_layer.update()
+                world_box_cache.clear()
+
+        selection = selected_collection(context, selected_objects)
+
+        # Store original transforms for undo functionality
+        with stats.phase("history"):
+            batch = snap_history.record(selection)
+
+        controls = [control_empty] if control_empty else []
+        if context.scene.create_control and not control_empty:
+            with stats.phase("control"):
+                batch["parents"] = {obj.session_uid: (obj.parent.session_uid if obj.parent else None,
+                                                      [tuple(row) for row in obj.matrix_parent_inverse])
+                                    for obj in selected_objects}
+                controls = self.create_controls(context, selected_objects)
+                batch["controls"] = [control.session_uid for control in controls]
+
+        return controls or selection
+
+    def create_controls(self, context, selected_objects):
+        """Parent the selection to new control empties, one for all of it or one per spatial cluster.
+
+        Each empty sits at its cluster's XY center and lowest point. Parenting is done directly through parent and
+        matrix_parent_inverse, keeping every child's world transform without touching the selection.
+        """
+        scene = context.scene
+        children = [obj for obj in selected_objects if obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}]
+        boxes = world_box_cache.get(children)
+        centers = (boxes[:, :2] + boxes[:, 3:5]) / 2
+
+        if scene.control_clustering == 'GRID':
+            labels = snap_core.grid_clusters(centers, scene.control_cluster_size)
+        elif scene.control_clustering == 'KMEANS':
+            labels = snap_core.kmeans_clusters(centers, scene.control_cluster_count)
+        else:
+            labels = np.zeros(len(children), dtype=np.int64)
+
+        controls = []
+        for label in range(labels.max() + 1 if len(labels) else 1):
+            members = np.flatnonzero(labels == label)
+            location = Vector((0, 0, 0))
+            if len(members):
+                location.xy = centers[members].mean(axis=0)
+                location.z = boxes[members, 2].min()
+
+            pivot_empty = bpy.data.objects.new("Empty", None)
+            context.collection.objects.link(pivot_empty)
+            pivot_empty.location = location
+            pivot_empty.empty_display_size = scene.pivot_empty_size
+            controls.append(pivot_empty)
+
+            # The empty's world matrix is a plain translation, so its inverse is known before the depsgraph runs
+            parent_inverse = Matrix.Translation(-location)
+            for i in members.tolist():
+                obj = children[i]
+                if obj.parent is not None:
+                    obj.matrix_basis = obj.matrix_world
+                obj.parent = pivot_empty
+                obj.matrix_parent_inverse = parent_inverse
+
+        child_set = set(children)
+        for obj in selected_objects:
+            if obj not in child_set:
+                obj.select_set(False)
+        for pivot_empty in controls:
+            pivot_empty.select_set(True)
+        context.view_layer.objects.active = controls[0]
+        # The new empties need evaluated world matrices before they can be measured and snapped
+        context.view_layer.update()
+
+        if len(controls) == 1:
+            self.report({'INFO'}, f"Created empty at Z: {controls[0].location.z}")
+        else:
+            self.report({'INFO'}, f"Created {len(controls)} control empties")
+        return controls
+
+class SnapToGroundOperator(SnapSetup, bpy.types.Operator):
     bl_idname = "object.snap_to_ground"
     bl_label = "Snap"
     bl_description = "Moves the control or selected objects down to the ground."
 
-    original_positions = {}
+    # SnapStats of the latest snap, shown in the panel
+    last_stats = None
 
     @classmethod
     def poll(cls, context):
         return context.selected_objects
 
     def execute(self, context):
-        selected_objects = context.selected_objects
-        control_empty = next((obj for obj in selected_objects if obj.type == 'EMPTY'), None)
+        stats = SnapStats()
+        SnapToGroundOperator.last_stats = stats
 
-        # Store original positions for undo functionality
-        self.original_positions = {obj.name: obj.location.copy() for obj in selected_objects}
+        if not context.scene.snap_profile:
+            return self.snap(context, stats)
 
-        if context.scene.clear_mesh:
-            for obj in selected_objects:
-                if obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}:
-                    bpy.ops.object.select_all(action='DESELECT')
-                    obj.select_set(True)
-                    bpy.context.view_layer.objects.active = obj
-                    bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-                    bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='MEDIAN')
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self.snap(context, stats)
+        finally:
+            profiler.disable()
+            path = os.path.join(bpy.app.tempdir, "simple_snap.prof")
+            profiler.dump_stats(path)
+            self.report({'INFO'}, f"Profile saved to {path}")
 
-        if context.scene.create_control and not control_empty:
-            control_empty = self.create_control(context, selected_objects)
-
-        objects_to_snap = [control_empty] if control_empty else selected_objects
-        distance_limit = context.scene.snap_detection_distance_limit
-        gap_offset = context.scene.snap_gap_offset
-        rotate_randomly_x = context.scene.snap_randomize_rotation_x
-        rotate_randomly_y = context.scene.snap_randomize_rotation_y
-        rotate_randomly_z = context.scene.snap_randomize_rotation_z
-        object_type = context.scene.snap_object_type
-        rotate_to_normal = context.scene.snap_rotate_to_normal
-
-        for obj in objects_to_snap:
-            if obj.type not in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}:
-                continue
+    def snap(self, context, stats):
+        objects_to_snap = self.prepare(context, stats)
+        job = SnapJob(context, objects_to_snap, stats)
+        job.run(objects_to_snap)
+        job.report(self)
+        return {'FINISHED'}
 
-            if rotate_randomly_x:
-                obj.rotation_euler.x += random.uniform(-180, 180) * (3.14159 / 180)
+class UndoOperator(bpy.types.Operator):
+    bl_idname = "object.undo_snap"
+    bl_label = "Undo"
+    bl_description = "Restores the objects of the last snap to their original transforms and removes its control empty."
 
-            if rotate_randomly_y:
-                obj.rotation_euler.y += random.uniform(-180, 180) * (3.14159 / 180)
+    @classmethod
+    def poll(cls, context):
+        return len(snap_history) > 0
 
-            if rotate_randomly_z:
-                obj.rotation_euler.z += random.uniform(-180, 180) * (3.14159 / 180)
+    def execute(self, context):
+        restored = snap_history.restore()
+        self.report({'INFO'}, f"Restored {restored} objects to their original transforms.")
+        return {'FINISHED'}
 
-            original_location = obj.location.copy()
+def ensure_fcurve(obj, data_path, index):
+    animation_data = obj.animation_data or obj.animation_data_create()
+    if animation_data.action is None:
+        animation_data.action = bpy.data.actions.new(obj.name + "Action")
+    action = animation_data.action
+    if hasattr(action, "fcurve_ensure_for_datablock"):
+        # Layered actions (Blender 4.4+) keep their curves per slot
+        return action.fcurve_ensure_for_datablock(obj, data_path, index=index)
+    fcurve = action.fcurves.find(data_path, index=index)
+    return fcurve or action.fcurves.new(data_path, index=index, action_group="Object Transforms")
 
-            if context.scene.enable_floor_selection and context.scene.target_floor_object:
-                closest_obj = context.scene.target_floor_object
-            else:
-                # Find the closest object below
-                closest_obj = None
-                closest_distance = float('inf')
-                obj_bottom_z = original_location.z - (obj.dimensions.z / 2)
-
-                for other in context.scene.objects:
-                    if other != obj and (object_type == 'ALL' or other.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}):
-                        other_bottom_z = other.location.z - (other.dimensions.z / 2)
-                        distance = obj_bottom_z - other_bottom_z
-
-                        if distance > 0 and abs(distance) < distance_limit:
-                            if (abs(original_location.x - other.location.x) < (obj.dimensions.x / 2 + other.dimensions.x / 2) and
-                                abs(original_location.y - other.location.y) < (obj.dimensions.y / 2 + other.dimensions.y / 2)):
-                                
-                                if abs(distance) < closest_distance:
-                                    closest_distance = abs(distance)
-                                    closest_obj = other
-
-            if closest_obj:
-                obj.location.z = closest_obj.location.z + (closest_obj.dimensions.z / 2 + obj.dimensions.z / 2 + gap_offset)
-
-                if rotate_to_normal and obj.type == 'MESH':
-                    bm = bmesh.new()
-                    bm.from_mesh(closest_obj.data)
-                    face_normal = None
-
-                    for face in bm.faces:
-                        if face.select:
-                            face_normal = face.normal
-                            break
-
-                    if face_normal is not None:
-                        rot = face_normal.to_track_quat('Z', 'Y')
-                        obj.rotation_euler = rot.to_euler()
-
-                    bm.free()
-
-                self.report({'INFO'}, f"Snapped {obj.name} to ground with Gap Offset {gap_offset}")
-            else:
-                self.report({'WARNING'}, f"No closest object found below for {obj.name}.")
+# Keyframe point properties written back in bulk, with their per-point width and array type
+KEYFRAME_ATTRIBUTES = (
+    ("co", 2, np.float32), ("handle_left", 2, np.float32), ("handle_right", 2, np.float32),
+    ("interpolation", 1, np.int32), ("handle_left_type", 1, np.int32), ("handle_right_type", 1, np.int32),
+    ("easing", 1, np.int32), ("type", 1, np.int32), ("back", 1, np.float32), ("amplitude", 1, np.float32),
+    ("period", 1, np.float32),
+)
+
+def gather_keyframes(points):
+    """Every KEYFRAME_ATTRIBUTES property of the keyframe points, as arrays with one row per point."""
+    attributes = {}
+    for name, width, dtype in KEYFRAME_ATTRIBUTES:
+        values = np.empty(len(points) * width, dtype=dtype)
+        points.foreach_get(name, values)
+        attributes[name] = values.reshape(len(points), -1)
+    return attributes
+
+def write_keys(obj, data_path, index, frames, values):
+    """Key values on frames in one go, replacing the curve's keys inside the frame range and keeping the others.
 
+    Keys outside the range keep their interpolation and handles. The new keys get Blender's defaults, like keys
+    inserted by hand.
+    """
+    fcurve = ensure_fcurve(obj, data_path, index)
+    points = fcurve.keyframe_points
+    existing = gather_keyframes(points)
+    keep = (existing["co"][:, 0] < frames[0]) | (existing["co"][:, 0] > frames[-1])
+    kept = int(np.count_nonzero(keep))
+
+    # Points past the kept count are dropped and the new keys added fresh, so they carry no stale settings
+    while len(points) > kept:
+        points.remove(points[-1], fast=True)
+    points.add(len(frames))
+    attributes = gather_keyframes(points)
+    for name, data in attributes.items():
+        data[:kept] = existing[name][keep]
+    new_co = np.column_stack((frames, values))
+    attributes["co"][kept:] = new_co
+    attributes["handle_left"][kept:] = new_co
+    attributes["handle_right"][kept:] = new_co
+    for name, data in attributes.items():
+        points.foreach_set(name, data.ravel())
+    # Sorts the keys by frame and recalculates the automatic handles
+    fcurve.update()
+
+class SnapBakeOperator(bpy.types.Operator):
+    bl_idname = "object.snap_bake"
+    bl_label = "Bake Snap"
+    bl_description = ("Snaps the selected objects on every frame of the scene range and keys their Z location, "
+                      "and their rotation with Rotate to Normal.")
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return context.selected_objects
+
+    def execute(self, context):
+        scene = context.scene
+        objects = [obj for obj in context.selected_objects if obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}]
+        frames = np.arange(scene.frame_start, scene.frame_end + 1, scene.frame_step)
+        frame_current = scene.frame_current
+
+        stats = SnapStats()
+        SnapToGroundOperator.last_stats = stats
+        z = np.empty((len(frames), len(objects)))
+        rotations = np.empty((len(frames), len(objects), 3))
+
+        wm = context.window_manager
+        wm.progress_begin(0, len(frames))
+        try:
+            for step, frame in enumerate(frames.tolist()):
+                with stats.phase("frame_set"):
+                    scene.frame_set(frame)
+                    world_box_cache.clear()
+                # Floors keep their surfaces between frames unless their evaluated geometry changes
+                job = SnapJob(context, objects, stats, randomize=False)
+                job.run(objects)
+                z[step] = gather_vectors(objects, "location")[:, 2]
+                rotations[step] = gather_vectors(objects, "rotation_euler")
+                wm.progress_update(step)
+
+            with stats.phase("keys"):
+                for column, obj in enumerate(objects):
+                    write_keys(obj, "location", 2, frames, z[:, column])
+                    if scene.snap_rotate_to_normal:
+                        for axis in range(3):
+                            write_keys(obj, "rotation_euler", axis, frames, rotations[:, column, axis])
+        finally:
+            wm.progress_end()
+            scene.frame_set(frame_current)
+            floor_disk_cache.prune()
+
+        self.report({'INFO'}, f"Baked {len(objects)} objects over {len(frames)} frames in {stats.total:.2f} s")
         return {'FINISHED'}
 
-    def create_control(self, context, selected_objects):
-        mid_point = Vector((0, 0, 0))
-        total_objects = len(selected_objects)
+def gather_instances(depsgraph, instancers):
+    """World boxes of the instances generated by the instancers, one row per instance.
 
-        lowest_z = float('inf')
-        for obj in selected_objects:
-            if obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}:
-                mid_point += obj.location
-                obj_bottom_z = obj.location.z - (obj.dimensions.z / 2)
-                lowest_z = min(lowest_z, obj_bottom_z)
+    Returns (instancer rows, instance indices, (n, 6) boxes). Instances made of several objects, like collections
+    on points, are merged into one box, and everything a collection instance empty generates counts as one instance.
+    """
+    rows_by_pointer = {obj.as_pointer(): row for row, obj in enumerate(instancers)}
+    whole = [obj.type == 'EMPTY' for obj in instancers]
+    # (object, data) pointers -> row in corners, instances of the same geometry share their local box
+    shapes_by_key = {}
+    corners, shapes, rows, indices, matrices = [], [], [], [], []
+    for instance in depsgraph.object_instances:
+        if not instance.is_instance:
+            continue
+        row = rows_by_pointer.get(instance.parent.original.as_pointer())
+        if row is None:
+            continue
+        obj = instance.object
+        key = (obj.original.as_pointer(), obj.data.as_pointer() if obj.data else 0)
+        shape = shapes_by_key.get(key)
+        if shape is None:
+            shape = shapes_by_key[key] = len(corners)
+            corners.append(np.array(obj.bound_box))
+        shapes.append(shape)
+        rows.append(row)
+        indices.append(0 if whole[row] else instance.persistent_id[0])
+        # The iterator reuses its matrix, so it has to be copied
+        matrices.append(instance.matrix_world.copy())
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, 6))
 
-        if total_objects > 0:
-            mid_point /= total_objects
+    boxes = snap_core.world_boxes(np.array(corners)[shapes], np.array(matrices, dtype=np.float32).reshape(-1, 4, 4))
+    rows = np.array(rows, dtype=np.int64)
+    indices = np.array(indices, dtype=np.int64)
+    groups, first, inverse = np.unique(rows * (int(indices.max()) + 1) + indices, return_index=True,
+                                       return_inverse=True)
+    merged = np.empty((len(groups), 6))
+    merged[:, :3] = np.inf
+    merged[:, 3:] = -np.inf
+    np.minimum.at(merged[:, :3], inverse, boxes[:, :3])
+    np.maximum.at(merged[:, 3:], inverse, boxes[:, 3:])
+    return rows[first], indices[first], merged
 
-        pivot_empty = bpy.data.objects.new("Empty", None)
-        context.collection.objects.link(pivot_empty)
-        pivot_empty.location = mid_point
-        pivot_empty.location.z = lowest_z
-        pivot_empty.empty_display_size = context.scene.pivot_empty_size
+def instance_offset_holder(obj, count, attribute_name):
+    """Mesh object next to a Geometry Nodes instancer with at least count loose vertices, one per instance index.
 
-        bpy.ops.object.select_all(action='DESELECT')
-        pivot_empty.select_set(True)
+    It is named after the instancer and the attribute, so the node tree can read it with an Object Info node.
+    """
+    name = f"{obj.name}_{attribute_name}"
+    holder = bpy.data.objects.get(name)
+    if holder is None or holder.type != 'MESH':
+        holder = bpy.data.objects.new(name, bpy.data.meshes.new(name))
+        collections = obj.users_collection or [bpy.context.scene.collection]
+        collections[0].objects.link(holder)
+        holder.hide_render = True
+    if len(holder.data.vertices) < count:
+        holder.data.vertices.add(count - len(holder.data.vertices))
+    return holder
 
-        for obj in selected_objects:
-            if obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}:
-                obj.select_set(True)
+def write_instance_offsets(obj, indices, offsets, attribute_name):
+    """Move the instances of one instancer by world Z offsets. Returns False when they cannot be mapped back.
 
-        bpy.context.view_layer.objects.active = pivot_empty
-        bpy.ops.object.parent_set(type='OBJECT', keep_transform=True)
+    A collection instance empty is moved itself and a vertex instancer gets its vertices moved. Other instancers get
+    the offsets in their local space as a vector point attribute of instance_offset_holder, indexed by instance.
+    """
+    if obj.type == 'EMPTY':
+        obj.location += local_offset(obj, float(offsets[0]))
+        return True
+    if not len(indices):
+        return False
 
-        self.report({'INFO'}, f"Created empty at Z: {pivot_empty.location.z}")
-        return pivot_empty
+    # World Z in the instancer's local space
+    direction = np.linalg.inv(np.array(obj.matrix_world, dtype=np.float64)[:3, :3])[:, 2]
+    if obj.instance_type == 'VERTS' and isinstance(obj.data, bpy.types.Mesh):
+        data = obj.data
+        count = len(data.vertices)
+        if indices.max() >= count:
+            return False
+        values = np.zeros((count, 3))
+        data.vertices.foreach_get("co", values.ravel())
+        values[indices] += offsets[:, None] * direction
+        data.vertices.foreach_set("co", values.ravel())
+        data.update()
+        return True
 
-class UndoOperator(bpy.types.Operator):
-    bl_idname = "object.undo_snap"
-    bl_label = "Undo"
-    bl_description = "Restores objects to their original positions and removes the empty."
+    # Scatters such as Distribute Points on Faces make instances that match none of the object's own points
+    data = instance_offset_holder(obj, int(indices.max()) + 1, attribute_name).data
+    values = np.zeros((len(data.vertices), 3))
+    attribute = data.attributes.get(attribute_name)
+    if attribute is not None and (attribute.data_type != 'FLOAT_VECTOR' or attribute.domain != 'POINT'):
+        data.attributes.remove(attribute)
+        attribute = None
+    if attribute is None:
+        attribute = data.attributes.new(attribute_name, 'FLOAT_VECTOR', 'POINT')
+    else:
+        # Earlier offsets are already applied to the instances, so the new ones add to them
+        attribute.data.foreach_get("vector", values.ravel())
+    values[indices] += offsets[:, None] * direction
+    attribute.data.foreach_set("vector", values.ravel())
+    data.update()
+    return True
+
+class SnapInstancesOperator(bpy.types.Operator):
+    bl_idname = "object.snap_instances"
+    bl_label = "Snap Instances"
+    bl_description = ("Snaps the instances of the selected instancers in bulk, without realizing them. Collection "
+                      "instance empties and vertex instancers are moved directly, Geometry Nodes instancers get a "
+                      "companion mesh whose snap_offset point attribute holds one offset per instance index.")
+    bl_options = {'REGISTER', 'UNDO'}
+
+    attribute_name = "snap_offset"
 
     @classmethod
     def poll(cls, context):
-        return context.active_object is not None and any(obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'} for obj in context.selected_objects)
+        return context.selected_objects
 
     def execute(self, context):
-        selected_objects = context.selected_objects
-        pivot_empty = next((obj for obj in selected_objects if obj.type == 'EMPTY'), None)
-
-        if pivot_empty:
-            for obj in selected_objects:
-                if obj.name in SnapToGroundOperator.original_positions:
-                    obj.location = SnapToGroundOperator.original_positions[obj.name]
-                    obj.rotation_euler = obj.rotation_euler.copy()
-
-            if pivot_empty in selected_objects:
-                bpy.ops.object.select_all(action='DESELECT')
-                pivot_empty.select_set(True)
-                bpy.context.view_layer.objects.active = pivot_empty
-                bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
-                bpy.data.objects.remove(pivot_empty)
-
-            self.report({'INFO'}, "Restored original positions and removed empty.")
-        else:
-            self.report({'WARNING'}, "No empty found.")
+        scene = context.scene
+        stats = SnapStats()
+        SnapToGroundOperator.last_stats = stats
+        instancers = list(context.selected_objects)
+        depsgraph = context.evaluated_depsgraph_get()
+
+        with stats.phase("gather"):
+            rows, indices, boxes = gather_instances(depsgraph, instancers)
+            centers = (boxes[:, :3] + boxes[:, 3:]) / 2
+            half = (boxes[:, 3:] - boxes[:, :3]) / 2
+        if not len(rows):
+            self.report({'WARNING'}, "The selected objects generate no instances.")
+            return {'CANCELLED'}
+
+        distance_limit = scene.snap_detection_distance_limit
+        with stats.phase("search"):
+            # Instances are always raycast, every instance of one instancer tests the same floors
+            target_floor, floor_objects = snap_target(scene, 'RAYCAST')
+            if target_floor:
+                floor_lists = [[target_floor]] * len(instancers)
+            else:
+                index = footprint_index(floor_objects, 'MESH')
+                floor_lists = []
+                for row in range(len(instancers)):
+                    own = boxes[rows == row]
+                    if not len(own):
+                        floor_lists.append([])
+                        continue
+                    low, high = own[:, :3].min(axis=0), own[:, 3:].max(axis=0)
+                    floor_lists.append([entry[0] for entry in index.query(low[0], high[0], low[1], high[1],
+                                                                          low[2] - distance_limit, high[2])
+                                        if entry[0].type == 'MESH'])
+            candidates = [floor_lists[row] for row in rows.tolist()]
+            heightfield = scene.snap_heightfield_resolution if scene.snap_heightfield else 0
+            surfaces = {floor: floor_surface(floor, stats, depsgraph, heightfield, floor == target_floor)
+                        for floor_list in floor_lists for floor in floor_list}
+            samples = scene.snap_footprint_samples
+            stats.count("rays_cast", sum(len(floor_list) for floor_list in candidates) * samples ** 2)
+            if samples > 1:
+                supports = snap_core.footprint_supports(surfaces, candidates, boxes, samples, half[:, 2] + distance_limit,
+                                                        scene.snap_footprint_combine)[0]
+            else:
+                supports = snap_core.surface_supports(surfaces, candidates, centers, half[:, 2] + distance_limit)[0]
+
+        with stats.phase("write"):
+            landed = ~np.isnan(supports)
+            offsets = np.zeros(len(rows))
+            offsets[landed] = (snap_core.landing_heights(supports[landed], half[landed, 2], scene.snap_gap_offset)
+                               - centers[landed, 2])
+            unmapped = []
+            for row, obj in enumerate(instancers):
+                mask = rows == row
+                if mask.any() and not write_instance_offsets(obj, indices[mask], offsets[mask], self.attribute_name):
+                    unmapped.append(obj.name)
+
+        floor_disk_cache.prune()
+        stats.count("instances", len(rows))
+        stats.count("snapped", int(landed.sum()))
+        self.report({'INFO'}, f"Snapped {int(landed.sum())} of {len(rows)} instances in {stats.total * 1000:.1f} ms")
+        if unmapped:
+            self.report({'WARNING'}, f"Instances of {', '.join(unmapped)} do not match the vertices of their "
+                                     f"instancer and were left unchanged")
+        return {'FINISHED'}
+
+class SnapChunkedOperator(SnapSetup, bpy.types.Operator):
+    bl_idname = "object.snap_to_ground_chunked"
+    bl_label = "Snap in Steps"
+    bl_description = ("Snaps the selection in small steps that keep the interface responsive, with progress in the "
+                      "status bar. Press Esc to cancel and restore the objects.")
+
+    # Seconds of snapping work per timer event
+    time_budget = 0.05
+    min_chunk_size = 16
 
+    @classmethod
+    def poll(cls, context):
+        return context.selected_objects
+
+    def invoke(self, context, event):
+        self.stats = SnapStats()
+        SnapToGroundOperator.last_stats = self.stats
+        objects_to_snap = self.prepare(context, self.stats)
+
+        self.job = SnapJob(context, objects_to_snap, self.stats)
+        self.job.chunked = True
+        self.objects = list(objects_to_snap)
+        if self.job.stack:
+            # Stacking settles from the bottom up, so lower objects go first
+            self.objects = [self.objects[i] for i in np.argsort(world_box_cache.get(self.objects)[:, 2], kind='stable')]
+        self.position = 0
+        self.chunk_size = 256
+
+        wm = context.window_manager
+        wm.progress_begin(0, max(len(self.objects), 1))
+        self.timer = wm.event_timer_add(0.01, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self.finish(context)
+            world_box_cache.clear()
+            restored = snap_history.restore()
+            self.report({'WARNING'}, f"Snap cancelled, restored {restored} objects.")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        deadline = time.perf_counter() + self.time_budget
+        try:
+            while self.position < len(self.objects) and time.perf_counter() < deadline:
+                chunk = self.objects[self.position:self.position + self.chunk_size]
+                start = time.perf_counter()
+                self.job.run(chunk)
+                self.position += len(chunk)
+
+                # Grow or shrink the chunks so one of them fills a good part of the budget
+                elapsed = time.perf_counter() - start
+                if elapsed < self.time_budget / 4:
+                    self.chunk_size *= 2
+                elif elapsed > self.time_budget:
+                    self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+        except ReferenceError:
+            # Objects were deleted while snapping, put back what was already moved
+            self.finish(context)
+            world_box_cache.clear()
+            snap_history.restore()
+            self.report({'WARNING'}, "Snap cancelled because objects were removed.")
+            return {'CANCELLED'}
+
+        context.window_manager.progress_update(self.position)
+        context.workspace.status_text_set(f"Snapping {self.position} of {len(self.objects)} objects, Esc to cancel")
+        if self.position < len(self.objects):
+            return {'RUNNING_MODAL'}
+
+        self.finish(context)
+        self.job.report(self)
         return {'FINISHED'}
 
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
 class SnapPanel(bpy.types.Panel):
     bl_label = "SimpleSnap"
     bl_idname = "OBJECT_PT_simple_snap"
@@ -197,12 +1641,32 @@ class SnapPanel(bpy.types.Panel):
         layout.prop(context.scene, "clear_mesh", text="Clear Mesh (Apply Transforms & Set Origin)")
         
         layout.operator(SnapToGroundOperator.bl_idname, text="Snap")
+        layout.operator(SnapChunkedOperator.bl_idname, text="Snap in Steps")
         layout.operator(UndoOperator.bl_idname, text="Undo")
+        layout.operator(SnapDragOperator.bl_idname, text="Snap While Moving")
+        layout.operator(SnapBakeOperator.bl_idname, text="Bake Snap")
+        layout.operator(SnapInstancesOperator.bl_idname, text="Snap Instances")
 
         layout.prop(context.scene, "enable_floor_selection", text="Enable Floor Selection")
         if context.scene.enable_floor_selection:
             layout.prop(context.scene, "target_floor_object", text="Target Floor Object")
+            layout.prop(context.scene, "target_floor_collection", text="Target Floor Collection")
+            if context.scene.target_floor_collection:
+                layout.prop(context.scene, "snap_proxy_tolerance")
         
+        layout.prop(context.scene, "snap_method")
+        if context.scene.snap_method == 'RAYCAST':
+            layout.prop(context.scene, "snap_footprint_samples")
+            if context.scene.snap_footprint_samples > 1:
+                layout.prop(context.scene, "snap_footprint_combine")
+        if context.scene.snap_method != 'BOUNDS':
+            layout.prop(context.scene, "snap_heightfield")
+            if context.scene.snap_heightfield:
+                layout.prop(context.scene, "snap_heightfield_resolution")
+            layout.prop(context.scene, "snap_disk_cache")
+        layout.prop(context.scene, "snap_stack")
+        layout.prop(context.scene, "snap_avoid_overlaps")
+        layout.prop(context.scene, "snap_auto")
         layout.prop(context.scene, "snap_detection_distance_limit")
         layout.prop(context.scene, "snap_gap_offset")
         layout.prop(context.scene, "snap_randomize_rotation_x")
@@ -215,10 +1679,102 @@ class SnapPanel(bpy.types.Panel):
 
         layout.label(text="Control Options")
         layout.prop(context.scene, "create_control", text="Add Control")
+        layout.prop(context.scene, "control_clustering")
+        if context.scene.control_clustering == 'GRID':
+            layout.prop(context.scene, "control_cluster_size")
+        elif context.scene.control_clustering == 'KMEANS':
+            layout.prop(context.scene, "control_cluster_count")
         
         layout.prop(context.scene, "pivot_empty_size")
         layout.prop(context.scene, "pivot_empty_z_offset")
 
+        layout.separator()
+
+        layout.label(text="Statistics")
+        layout.prop(context.scene, "snap_profile")
+        stats = SnapToGroundOperator.last_stats
+        if stats:
+            box = layout.box()
+            box.label(text=f"Last snap: {stats.total * 1000:.1f} ms")
+            for name, seconds in stats.phases.items():
+                box.label(text=f"{name.replace('_', ' ').title()}: {seconds * 1000:.1f} ms")
+            for name, value in stats.counters.items():
+                box.label(text=f"{name.replace('_', ' ').capitalize()}: {value}")
+
+class SnapDragOperator(bpy.types.Operator):
+    bl_idname = "object.snap_drag"
+    bl_label = "Snap While Moving"
+    bl_description = "Keeps the selected objects on the ground while they are moved. Press Esc to stop."
+
+    # Seconds of snapping work allowed per event, the rest carries over to the next one
+    time_budget = 0.004
+
+    @classmethod
+    def poll(cls, context):
+        return context.selected_objects
+
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            context.window_manager.event_timer_remove(self.timer)
+            return {'CANCELLED'}
+        if event.type in {'TIMER', 'MOUSEMOVE'}:
+            try:
+                self.resnap(context)
+            except ReferenceError:
+                # An object was deleted while we were tracking it
+                context.window_manager.event_timer_remove(self.timer)
+                return {'CANCELLED'}
+        return {'PASS_THROUGH'}
+
+    def invoke(self, context, event):
+        scene = context.scene
+        self.objects = [obj for obj in context.selected_objects if obj.type in {'MESH', 'CURVE', 'EMPTY', 'ARMATURE'}]
+        self.snap_method = scene.snap_method
+        self.target_floor, floor_objects = snap_target(scene, self.snap_method)
+
+        # The floor stays static while dragging, so the dragged objects are left out of the index
+        self.floor_index = None
+        if not self.target_floor:
+            self.floor_index = footprint_index(floor_objects, scene.snap_object_type, exclude=set(self.objects))
+
+        self.last_xy = gather_vectors(self.objects, "location")[:, :2]
+        self.pending = {}
+        self.timer = context.window_manager.event_timer_add(1 / 60, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def resnap(self, context):
+        scene = context.scene
+        locations = gather_vectors(self.objects, "location")
+        moved = np.flatnonzero(np.any(locations[:, :2] != self.last_xy, axis=1))
+        self.last_xy[moved] = locations[moved, :2]
+        self.pending.update(dict.fromkeys(moved.tolist()))
+        if not self.pending:
+            return
+        depsgraph = context.evaluated_depsgraph_get()
+
+        deadline = time.perf_counter() + self.time_budget
+        while self.pending and time.perf_counter() < deadline:
+            i = next(iter(self.pending))
+            del self.pending[i]
+            obj = self.objects[i]
+
+            box = object_box(obj)
+            center = ((box[0] + box[1]) / 2, (box[2] + box[3]) / 2, (box[4] + box[5]) / 2)
+            half_z = (box[5] - box[4]) / 2
+            support = find_support(obj, box[:5], center, half_z, self.floor_index, self.target_floor,
+                                   self.snap_method, scene.snap_detection_distance_limit, depsgraph)
+            if support is None:
+                continue
+
+            floor, support_z, triangle_index = support
+            obj.location += local_offset(obj, snap_core.landing_heights(support_z, half_z, scene.snap_gap_offset)
+                                         - center[2])
+            if scene.snap_rotate_to_normal and obj.type == 'MESH':
+                face_normal = floor_normal_below(floor, center, triangle_index, depsgraph)
+                if face_normal is not None:
+                    obj.rotation_euler = face_normal.to_track_quat('Z', 'Y').to_euler()
+
 class SimpleSnapKeymap(bpy.types.Operator):
     bl_idname = "object.simple_snap_keymap"
     bl_label = "Simple Snap Keymap"
@@ -240,6 +1796,10 @@ def register():
     bpy.utils.register_class(SnapPanel)
     bpy.utils.register_class(SnapToGroundOperator)
     bpy.utils.register_class(UndoOperator)
+    bpy.utils.register_class(SnapChunkedOperator)
+    bpy.utils.register_class(SnapBakeOperator)
+    bpy.utils.register_class(SnapInstancesOperator)
+    bpy.utils.register_class(SnapDragOperator)
     bpy.utils.register_class(SimpleSnapKeymap)
 
     bpy.types.Scene.snap_detection_distance_limit = bpy.props.FloatProperty(
@@ -268,10 +1828,94 @@ def register():
         default='MESH'
     )
     bpy.types.Scene.snap_rotate_to_normal = bpy.props.BoolProperty(name="Rotate to Normal", default=False)
+    bpy.types.Scene.snap_auto = bpy.props.BoolProperty(
+        name="Auto Snap",
+        default=False,
+        description="Snap selected objects to the ground automatically whenever they are moved."
+    )
+    bpy.types.Scene.snap_method = bpy.props.EnumProperty(
+        name="Snap Method",
+        items=[
+            ('BOUNDS', "Bounds", "Place objects on top of the closest object's bounding box"),
+            ('RAYCAST', "Raycast", "Cast rays down onto the floor geometry"),
+            ('CONTACT', "Contact", "Drop the lowest points of each mesh onto the floor geometry")
+        ],
+        default='BOUNDS'
+    )
+    
+    bpy.types.Scene.snap_footprint_samples = bpy.props.IntProperty(
+        name="Footprint Rays",
+        default=1,
+        min=1,
+        max=32,
+        description="Rays per side of a grid cast over each object's footprint with the Raycast method. 1 casts a single ray from the center."
+    )
+    bpy.types.Scene.snap_footprint_combine = bpy.props.EnumProperty(
+        name="Combine Hits",
+        items=[
+            ('MAX', "Highest", "Rest on the highest hit, so objects sit on peaks"),
+            ('PLANE', "Plane Fit", "Fit a plane through the hits, for a stable height and tilt on rough ground")
+        ],
+        default='MAX'
+    )
+    bpy.types.Scene.snap_heightfield = bpy.props.BoolProperty(
+        name="Terrain Heightfield",
+        default=False,
+        description="Rasterize terrain floors once into a grid of heights and snap with grid lookups, much faster for large selections. Floors with overhangs or vertical faces are still raycast exactly."
+    )
+    bpy.types.Scene.snap_heightfield_resolution = bpy.props.IntProperty(
+        name="Heightfield Resolution",
+        default=512,
+        min=16,
+        max=2048,
+        description="Grid cells per side of the terrain height grid. Higher follows small bumps more closely but takes longer to build."
+    )
+    bpy.types.Scene.snap_avoid_overlaps = bpy.props.BoolProperty(
+        name="Avoid Overlaps",
+        default=False,
+        description="After snapping, lift objects that intersect each other or nearby objects onto the highest one they actually touch."
+    )
+    bpy.types.Scene.snap_disk_cache = bpy.props.BoolProperty(
+        name="Cache on Disk",
+        default=False,
+        description="Save floor acceleration data in a .simple_snap_cache folder next to the .blend file, so the first snap after opening the file does not rebuild it."
+    )
+    bpy.types.Scene.snap_stack = bpy.props.BoolProperty(
+        name="Stack Selection",
+        default=False,
+        description="Settle the selection from the bottom up in one pass, so overlapping objects stack on each other."
+    )
+    bpy.types.Scene.snap_profile = bpy.props.BoolProperty(
+        name="Profile Snap",
+        default=False,
+        description="Run each snap under cProfile and save the result to simple_snap.prof in Blender's temp directory."
+    )
     
     bpy.types.Scene.clear_mesh = bpy.props.BoolProperty(name="Clear Mesh", default=False, description="Apply all transforms and set origin to geometry when snapping.")
     bpy.types.Scene.create_control = bpy.props.BoolProperty(name="Add Control", default=False, description="Create a control empty when snapping.")
 
+    bpy.types.Scene.control_clustering = bpy.props.EnumProperty(
+        name="Clustering",
+        items=[
+            ('NONE', "Single", "One control for the whole selection"),
+            ('GRID', "Grid", "One control per occupied grid cell"),
+            ('KMEANS', "K-Means", "One control per k-means cluster of the object positions")
+        ],
+        default='NONE',
+        description="Split the selection into spatial clusters with one control empty each."
+    )
+    bpy.types.Scene.control_cluster_size = bpy.props.FloatProperty(
+        name="Cluster Size",
+        default=10.0,
+        min=0.001,
+        step=10
+    )
+    bpy.types.Scene.control_cluster_count = bpy.props.IntProperty(
+        name="Cluster Count",
+        default=8,
+        min=1
+    )
+
     bpy.types.Scene.pivot_empty_size = bpy.props.FloatProperty(
         name="Control Size",
         default=1.0,
@@ -297,15 +1941,42 @@ def register():
         type=bpy.types.Object,
         description="Select the object to snap to."
     )
+    bpy.types.Scene.target_floor_collection = bpy.props.PointerProperty(
+        name="Target Floor Collection",
+        type=bpy.types.Collection,
+        description="Snap to the objects of this collection, merged into one floor. Takes precedence over the target object."
+    )
+    bpy.types.Scene.snap_proxy_tolerance = bpy.props.FloatProperty(
+        name="Proxy Tolerance",
+        default=0.0,
+        min=0.0,
+        step=0.1,
+        description="Merge floor collection vertices closer than this before raycasting, for faster builds on dense scans. 0 uses the full geometry."
+    )
 
+    bpy.app.handlers.depsgraph_update_post.append(invalidate_floor_geometry)
+    bpy.app.handlers.depsgraph_update_post.append(invalidate_world_boxes)
+    bpy.app.handlers.frame_change_post.append(clear_world_boxes)
+    bpy.app.handlers.depsgraph_update_post.append(auto_snap)
+    bpy.app.handlers.undo_post.append(reset_auto_snap)
+    bpy.app.handlers.redo_post.append(reset_auto_snap)
+    bpy.app.handlers.load_post.append(reset_auto_snap)
+    bpy.app.handlers.load_post.append(clear_floor_caches)
+
+    # There are no keyconfigs when Blender runs in background mode
     wm = bpy.context.window_manager
-    km = wm.keyconfigs.default.keymaps['3D View']
-    kmi = km.keymap_items.new(SimpleSnapKeymap.bl_idname, 'END', 'PRESS')
+    if wm.keyconfigs.default:
+        km = wm.keyconfigs.default.keymaps['3D View']
+        kmi = km.keymap_items.new(SimpleSnapKeymap.bl_idname, 'END', 'PRESS')
 
 def unregister():
     bpy.utils.unregister_class(SnapPanel)
     bpy.utils.unregister_class(SnapToGroundOperator)
     bpy.utils.unregister_class(UndoOperator)
+    bpy.utils.unregister_class(SnapChunkedOperator)
+    bpy.utils.unregister_class(SnapBakeOperator)
+    bpy.utils.unregister_class(SnapInstancesOperator)
+    bpy.utils.unregister_class(SnapDragOperator)
     bpy.utils.unregister_class(SimpleSnapKeymap)
 
     del bpy.types.Scene.snap_detection_distance_limit
@@ -315,19 +1986,52 @@ def unregister():
     del bpy.types.Scene.snap_randomize_rotation_z
     del bpy.types.Scene.snap_object_type
     del bpy.types.Scene.snap_rotate_to_normal
+    del bpy.types.Scene.snap_method
+    del bpy.types.Scene.snap_auto
+    del bpy.types.Scene.snap_stack
+    del bpy.types.Scene.snap_disk_cache
+    del bpy.types.Scene.snap_avoid_overlaps
+    del bpy.types.Scene.snap_footprint_samples
+    del bpy.types.Scene.snap_footprint_combine
+    del bpy.types.Scene.snap_heightfield
+    del bpy.types.Scene.snap_heightfield_resolution
+    del bpy.types.Scene.snap_profile
     del bpy.types.Scene.clear_mesh
     del bpy.types.Scene.create_control
+    del bpy.types.Scene.control_clustering
+    del bpy.types.Scene.control_cluster_size
+    del bpy.types.Scene.control_cluster_count
     del bpy.types.Scene.pivot_empty_size
     del bpy.types.Scene.pivot_empty_z_offset
     del bpy.types.Scene.enable_floor_selection
     del bpy.types.Scene.target_floor_object
+    del bpy.types.Scene.target_floor_collection
+    del bpy.types.Scene.snap_proxy_tolerance
+
+    if invalidate_floor_geometry in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(invalidate_floor_geometry)
+    if invalidate_world_boxes in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(invalidate_world_boxes)
+    if clear_world_boxes in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(clear_world_boxes)
+    if auto_snap in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(auto_snap)
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post, bpy.app.handlers.load_post):
+        if reset_auto_snap in handlers:
+            handlers.remove(reset_auto_snap)
+    if clear_floor_caches in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(clear_floor_caches)
+    _auto_snap.reset()
+    clear_floor_caches()
+    snap_history.batches.clear()
 
     wm = bpy.context.window_manager
-    km = wm.keyconfigs.default.keymaps['3D View']
-    for kmi in km.keymap_items:
-        if kmi.idname == SimpleSnapKeymap.bl_idname:
-            km.keymap_items.remove(kmi)
-            break
+    if wm.keyconfigs.default:
+        km = wm.keyconfigs.default.keymaps['3D View']
+        for kmi in km.keymap_items:
+            if kmi.idname == SimpleSnapKeymap.bl_idname:
+                km.keymap_items.remove(kmi)
+                break
 
 if __name__ == "__main__":
     register()
@@ -0,0 +1,183 @@
+"""Benchmarks for SimpleSnap on synthetic scenes.
+
+Runs with the ``bpy`` module (``pip install bpy``) or inside ``blender -b --python``:
+
+    python benchmarks/bench_snap.py --sizes 1000 10000 --output results.json
+    python benchmarks/bench_snap.py --output new.json --compare results.json
+
+Every configuration builds a fresh scene with a floor and N cubes scattered above it, snaps all of
+them once and records the total time together with the per-phase timings of the operator. With
+--compare the results are checked against an earlier run and the script exits with status 1 when a
+configuration got slower than the threshold allows.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bpy
+import numpy as np
+
+from snap_batch import load_addon
+
+SIZES = [1000, 10000, 100000]
+FLOORS = ["flat", "terrain"]
+VARIANTS = {
+    "base": {},
+    "clear_mesh": {"clear_mesh": True},
+    "create_control": {"create_control": True},
+    "rotate_to_normal": {"snap_rotate_to_normal": True},
+}
+METHODS = ["BOUNDS", "RAYCAST", "CONTACT"]
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark SimpleSnap on synthetic scenes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Object counts to test")
+    parser.add_argument("--floors", nargs="+", choices=FLOORS, default=FLOORS)
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--floor-resolution", type=int, default=200, help="Floor grid subdivisions per side")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per configuration, the fastest one is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this path instead of stdout")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown ratio that counts as a regression when comparing")
+    return parser
+
+def build_floor(kind, resolution, size):
+    """Grid floor centered at the origin, flat or with rolling hills."""
+    steps = np.linspace(-size / 2, size / 2, resolution + 1)
+    x, y = np.meshgrid(steps, steps)
+    if kind == "terrain":
+        z = np.sin(x * 0.15) * np.cos(y * 0.15) * 2 + np.sin(x * 0.05 + 1) * 3
+    else:
+        z = np.zeros_like(x)
+    vertices = np.column_stack((x.ravel(), y.ravel(), z.ravel()))
+
+    row = resolution + 1
+    corner = (np.arange(resolution)[:, None] * row + np.arange(resolution)[None, :]).ravel()
+    faces = np.column_stack((corner, corner + 1, corner + row + 1, corner + row))
+
+    mesh = bpy.data.meshes.new("BenchFloor")
+    mesh.from_pydata(vertices.tolist(), [], faces.tolist())
+    mesh.update()
+    floor = bpy.data.objects.new("BenchFloor", mesh)
+    bpy.context.scene.collection.objects.link(floor)
+    return floor
+
+def build_scene(floor_kind, count, resolution, seed):
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+
+    size = max(20.0, math.sqrt(count) * 3)
+    floor = build_floor(floor_kind, resolution, size)
+
+    bpy.ops.mesh.primitive_cube_add(size=1)
+    cube = bpy.context.active_object
+    cube.data.name = "BenchCube"
+    bpy.data.objects.remove(cube)
+
+    rng = np.random.default_rng(seed)
+    locations = np.column_stack((rng.uniform(-size / 2, size / 2, (count, 2)), rng.uniform(10, 20, count)))
+    collection = bpy.context.scene.collection
+    mesh = bpy.data.meshes["BenchCube"]
+    for i, location in enumerate(locations.tolist()):
+        obj = bpy.data.objects.new(f"BenchCube.{i}", mesh)
+        obj.location = location
+        collection.objects.link(obj)
+
+    bpy.context.view_layer.update()
+    for obj in bpy.context.view_layer.objects:
+        obj.select_set(obj != floor)
+    bpy.context.view_layer.objects.active = None
+    return floor
+
+def run_configuration(args, addon, floor_kind, count, variant, method):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        build_scene(floor_kind, count, args.floor_resolution, args.seed)
+        generate_time = time.perf_counter() - start
+
+        scene = bpy.context.scene
+        scene.snap_method = method
+        for prop, value in VARIANTS[variant].items():
+            setattr(scene, prop, value)
+
+        start = time.perf_counter()
+        bpy.ops.object.snap_to_ground()
+        total_time = time.perf_counter() - start
+
+        if best is None or total_time < best["total_time"]:
+            best = {
+                "total_time": total_time,
+                "generate_time": generate_time,
+                "phases": dict(addon.SnapToGroundOperator.last_stats.phases),
+                "counters": dict(addon.SnapToGroundOperator.last_stats.counters),
+            }
+    return best
+
+def configuration_key(result):
+    return f'{result["floor"]}/{result["objects"]}/{result["variant"]}/{result["method"]}'
+
+def compare(results, baseline_path, threshold):
+    """Print the speed ratio of every configuration and return the keys that regressed."""
+    with open(baseline_path) as f:
+        baseline = {configuration_key(result): result for result in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        key = configuration_key(result)
+        old = baseline.get(key)
+        if old is None:
+            continue
+        ratio = result["total_time"] / old["total_time"] if old["total_time"] else float("inf")
+        marker = "  REGRESSION" if ratio > threshold else ""
+        print(f'{key}: {old["total_time"]:.4f}s -> {result["total_time"]:.4f}s ({ratio:.2f}x){marker}')
+        if ratio > threshold:
+            regressions.append(key)
+    return regressions
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    args = build_parser().parse_args(argv)
+    addon = load_addon()
+
+    results = []
+    for floor_kind, count, variant, method in itertools.product(args.floors, args.sizes, args.variants, args.methods):
+        result = {"floor": floor_kind, "objects": count, "variant": variant, "method": method}
+        result.update(run_configuration(args, addon, floor_kind, count, variant, method))
+        results.append(result)
+        print(f'{configuration_key(result)}: {result["total_time"]:.4f}s', file=sys.stderr)
+
+    report = {
+        "meta": {
+            "blender": bpy.app.version_string,
+            "numpy": np.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "floor_resolution": args.floor_resolution,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Headless batch snapping for SimpleSnap.
+
+Run it with plain Python to snap many .blend files in parallel worker Blender processes:
+
+    python snap_batch.py scenes/*.blend --collection Props --gap-offset 0.0 --summary summary.json
+
+Each file is opened with ``blender -b``, the objects matching the filters are selected and snapped
+with the current add-on code, and the file is saved back (or into --output-dir). A JSON summary with
+per-file timings is written at the end.
+"""
+
+import argparse
+import fnmatch
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RESULT_PREFIX = "SIMPLESNAP_RESULT "
+
+# Command line option -> (scene property, type)
+SCENE_OPTIONS = {
+    "distance_limit": ("snap_detection_distance_limit", float),
+    "gap_offset": ("snap_gap_offset", float),
+    "randomize_x": ("snap_randomize_rotation_x", bool),
+    "randomize_y": ("snap_randomize_rotation_y", bool),
+    "randomize_z": ("snap_randomize_rotation_z", bool),
+    "object_type": ("snap_object_type", str),
+    "rotate_to_normal": ("snap_rotate_to_normal", bool),
+    "method": ("snap_method", str),
+    "stack": ("snap_stack", bool),
+    "avoid_overlaps": ("snap_avoid_overlaps", bool),
+    "footprint_rays": ("snap_footprint_samples", int),
+    "footprint_combine": ("snap_footprint_combine", str),
+    "heightfield": ("snap_heightfield", bool),
+    "heightfield_resolution": ("snap_heightfield_resolution", int),
+    "disk_cache": ("snap_disk_cache", bool),
+    "clear_mesh": ("clear_mesh", bool),
+    "create_control": ("create_control", bool),
+    "control_size": ("pivot_empty_size", float),
+    "control_z_offset": ("pivot_empty_z_offset", float),
+    "control_clustering": ("control_clustering", str),
+    "cluster_size": ("control_cluster_size", float),
+    "cluster_count": ("control_cluster_count", int),
+    "proxy_tolerance": ("snap_proxy_tolerance", float),
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Snap objects to the ground in many .blend files.")
+    parser.add_argument("files", nargs="*", help=".blend files to process")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of worker Blender processes")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a worker is killed")
+    parser.add_argument("--summary", help="Write the JSON summary to this path instead of stdout")
+    parser.add_argument("--output-dir", help="Save snapped files here instead of overwriting the inputs")
+    parser.add_argument("--no-save", action="store_true", help="Snap without saving, useful for timing")
+
+    parser.add_argument("--collection", help="Only snap objects in this collection (including child collections)")
+    parser.add_argument("--name", help="Only snap objects whose name matches this glob pattern")
+    parser.add_argument("--floor", help="Name of the target floor object")
+    parser.add_argument("--floor-collection", help="Name of a collection to use as the floor")
+    parser.add_argument("--instances", action="store_true",
+                        help="Snap the instances generated by the matching objects instead of the objects")
+
+    parser.add_argument("--distance-limit", type=float)
+    parser.add_argument("--gap-offset", type=float)
+    parser.add_argument("--object-type", choices=["MESH", "ALL"])
+    parser.add_argument("--method", choices=["BOUNDS", "RAYCAST", "CONTACT"])
+    parser.add_argument("--footprint-rays", type=int)
+    parser.add_argument("--footprint-combine", choices=["MAX", "PLANE"])
+    parser.add_argument("--heightfield-resolution", type=int)
+    parser.add_argument("--control-size", type=float)
+    parser.add_argument("--control-z-offset", type=float)
+    parser.add_argument("--control-clustering", choices=["NONE", "GRID", "KMEANS"])
+    parser.add_argument("--cluster-size", type=float)
+    parser.add_argument("--cluster-count", type=int)
+    parser.add_argument("--proxy-tolerance", type=float)
+    for option in ("randomize_x", "randomize_y", "randomize_z", "rotate_to_normal", "stack", "avoid_overlaps",
+                   "heightfield", "disk_cache", "clear_mesh", "create_control"):
+        parser.add_argument("--" + option.replace("_", "-"), action=argparse.BooleanOptionalAction, default=None)
+
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser
+
+def worker_arguments(args):
+    """Options forwarded unchanged from the controller to every worker."""
+    forwarded = []
+    for key, value in vars(args).items():
+        if key in {"files", "blender", "jobs", "timeout", "summary", "worker"} or value is None:
+            continue
+        flag = "--" + key.replace("_", "-")
+        if isinstance(value, bool):
+            if key in SCENE_OPTIONS:
+                forwarded.append(flag if value else "--no-" + key.replace("_", "-"))
+            elif value:
+                forwarded.append(flag)
+        else:
+            forwarded.extend((flag, str(value)))
+    return forwarded
+
+def run_file(args, path):
+    command = [args.blender, "-b", "--factory-startup", path, "--python", os.path.abspath(__file__),
+               "--", "--worker"] + worker_arguments(args)
+
+    start = time.perf_counter()
+    result = {"file": path}
+    try:
+        process = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        result.update(status="timeout")
+    else:
+        lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if lines:
+            result.update(json.loads(lines[-1][len(RESULT_PREFIX):]))
+        else:
+            result.update(status="error", returncode=process.returncode, stderr=process.stderr[-2000:])
+    result["wall_time"] = time.perf_counter() - start
+    return result
+
+def run_controller(args):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(lambda path: run_file(args, path), args.files))
+
+    summary = {
+        "files": results,
+        "jobs": args.jobs,
+        "total_time": time.perf_counter() - start,
+        "succeeded": sum(1 for result in results if result.get("status") == "ok"),
+        "failed": sum(1 for result in results if result.get("status") != "ok"),
+        "objects_snapped": sum(result.get("objects", 0) for result in results),
+    }
+    text = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0 if summary["failed"] == 0 else 1
+
+def load_addon():
+    """Import and register the add-on this script ships with, whether or not it is installed."""
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location("simple_snap_batch_addon", os.path.join(addon_dir, "__init__.py"),
+                                                  submodule_search_locations=[addon_dir])
+    addon = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = addon
+    spec.loader.exec_module(addon)
+    addon.register()
+    return addon
+
+def matching_objects(bpy, args):
+    if args.collection:
+        collection = bpy.data.collections.get(args.collection)
+        objects = collection.all_objects if collection else []
+    else:
+        objects = bpy.context.view_layer.objects
+    view_layer_objects = set(bpy.context.view_layer.objects)
+    # The floors stay where they are, or Bounds snapping would land a floor on its own top
+    floors = set()
+    if args.floor:
+        floors.add(bpy.data.objects[args.floor])
+    if args.floor_collection:
+        floors.update(bpy.data.collections[args.floor_collection].all_objects)
+    return [obj for obj in objects
+            if obj in view_layer_objects and obj not in floors
+            and (not args.name or fnmatch.fnmatchcase(obj.name, args.name))]
+
+def run_worker(args):
+    import bpy
+
+    start = time.perf_counter()
+    load_addon()
+    scene = bpy.context.scene
+
+    for option, (prop, _) in SCENE_OPTIONS.items():
+        value = getattr(args, option)
+        if value is not None:
+            setattr(scene, prop, value)
+    if args.floor:
+        scene.target_floor_object = bpy.data.objects[args.floor]
+        scene.enable_floor_selection = True
+    if args.floor_collection:
+        scene.target_floor_collection = bpy.data.collections[args.floor_collection]
+        scene.enable_floor_selection = True
+
+    objects = matching_objects(bpy, args)
+    for obj in bpy.context.view_layer.objects:
+        obj.select_set(False)
+    for obj in objects:
+        obj.select_set(True)
+
+    snap_start = time.perf_counter()
+    if objects and args.instances:
+        bpy.ops.object.snap_instances()
+    elif objects:
+        bpy.ops.object.snap_to_ground()
+    snap_time = time.perf_counter() - snap_start
+
+    if not args.no_save:
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            bpy.ops.wm.save_as_mainfile(filepath=os.path.join(args.output_dir, os.path.basename(bpy.data.filepath)))
+        else:
+            bpy.ops.wm.save_mainfile()
+
+    print(RESULT_PREFIX + json.dumps({
+        "status": "ok",
+        "objects": len(objects),
+        "snap_time": snap_time,
+        "worker_time": time.perf_counter() - start,
+    }))
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    args = build_parser().parse_args(argv)
+    if args.worker:
+        try:
+            run_worker(args)
+        except Exception as error:
+            print(RESULT_PREFIX + json.dumps({"status": "error", "error": repr(error)}))
+            sys.exit(1)
+    else:
+        sys.exit(run_controller(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,904 @@
+"""Snapping math for SimpleSnap that doesn't depend on Blender.
+
+Everything in here works on plain Python values and NumPy arrays, so it can be profiled, benchmarked
+and reused outside Blender. The add-on gathers object transforms and floor geometry into arrays and
+hands them to these functions.
+"""
+
+import json
+import math
+import os
+import time
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+import numpy as np
+
+class SnapStats:
+    """Wall time per named phase and event counters for one snap run.
+
+    Phases may be nested to break a phase down further; only the outermost ones add to the total.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self._depth = 0
+        self._total = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if not self._depth:
+                self._total += elapsed
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @property
+    def total(self):
+        return self._total
+
+    def summary(self):
+        """One line with every phase in milliseconds followed by the counters."""
+        parts = [f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.phases.items()]
+        parts += [f"{name} {value}" for name, value in self.counters.items()]
+        return ", ".join(parts)
+
+def world_boxes(corners, matrices):
+    """World-space (min_x, min_y, min_z, max_x, max_y, max_z) rows from local bound box corners and world matrices.
+
+    corners has shape (n, 8, 3) and matrices (n, 4, 4) with row-major matrices.
+    """
+    corners = np.asarray(corners, dtype=np.float64).reshape(-1, 8, 3)
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    world = corners @ matrices[:, :3, :3].transpose(0, 2, 1) + matrices[:, None, :3, 3]
+    return np.hstack((world.min(axis=1), world.max(axis=1)))
+
+def footprint_bounds(boxes):
+    """Per-object (min_x, max_x, min_y, max_y, bottom_z) lists from world box rows."""
+    return boxes[:, [0, 3, 1, 4, 2]].tolist()
+
+def box_entries(items, boxes):
+    """FootprintIndex entries (item, min_x, max_x, min_y, max_y, min_z, max_z) from world box rows."""
+    return [(item, min_x, max_x, min_y, max_y, min_z, max_z)
+            for item, (min_x, min_y, min_z, max_x, max_y, max_z) in zip(items, boxes.tolist())]
+
+class FootprintIndex:
+    """Uniform XY grid over object footprints, with every cell sorted by bottom Z."""
+
+    # Objects spanning more cells than this (terrains, big floors) are kept aside
+    # and tested directly instead of being copied into every cell they touch.
+    max_cells_per_entry = 64
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.cells = {}
+        self.oversized = []
+        self.positions = None
+        # Candidate entries looked at by queries so far
+        self.tested = 0
+
+        if entries:
+            widths = sorted(max(e[2] - e[1], e[4] - e[3]) for e in entries)
+            self.cell_size = max(widths[len(widths) // 2], 1e-3)
+        else:
+            self.cell_size = 1.0
+
+        for index, entry in enumerate(entries):
+            keys = self._entry_cells(entry)
+            if keys is None:
+                self.oversized.append(index)
+                continue
+            for key in keys:
+                self.cells.setdefault(key, []).append((entry[5], index))
+
+        # Sorting by bottom Z lets a query bisect straight to its height range
+        self.cell_bottoms = {}
+        for key, bucket in self.cells.items():
+            bucket.sort()
+            self.cell_bottoms[key] = [bottom for bottom, _ in bucket]
+
+    def _cell_range(self, min_x, max_x, min_y, max_y):
+        size = self.cell_size
+        return (math.floor(min_x / size), math.floor(max_x / size),
+                math.floor(min_y / size), math.floor(max_y / size))
+
+    def _entry_cells(self, entry):
+        """Grid cells covered by an entry, or None for oversized entries."""
+        x0, x1, y0, y1 = self._cell_range(entry[1], entry[2], entry[3], entry[4])
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells_per_entry:
+            return None
+        return [(ix, iy) for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1)]
+
+    def update(self, item, box):
+        """Re-insert the (min_x, max_x, min_y, max_y, min_z, max_z) box of an item that moved, adding it if needed."""
+        if self.positions is None:
+            self.positions = {entry[0]: index for index, entry in enumerate(self.entries)}
+
+        index = self.positions.get(item)
+        if index is None:
+            index = self.positions[item] = len(self.entries)
+            self.entries.append(None)
+        else:
+            self._remove(index)
+
+        entry = self.entries[index] = (item,) + tuple(box)
+        keys = self._entry_cells(entry)
+        if keys is None:
+            self.oversized.append(index)
+            return
+        for key in keys:
+            bucket = self.cells.setdefault(key, [])
+            bottoms = self.cell_bottoms.setdefault(key, [])
+            position = bisect_right(bottoms, entry[5])
+            bucket.insert(position, (entry[5], index))
+            bottoms.insert(position, entry[5])
+
+    def _remove(self, index):
+        entry = self.entries[index]
+        keys = self._entry_cells(entry)
+        if keys is None:
+            self.oversized.remove(index)
+            return
+        for key in keys:
+            bucket = self.cells[key]
+            bottoms = self.cell_bottoms[key]
+            position = bisect_left(bottoms, entry[5])
+            while bucket[position][1] != index:
+                position += 1
+            del bucket[position]
+            del bottoms[position]
+
+    def query(self, min_x, max_x, min_y, max_y, low_z, high_z):
+        """Yield entries overlapping the footprint whose bottom lies strictly between low_z and high_z."""
+        seen = set()
+        x0, x1, y0, y1 = self._cell_range(min_x, max_x, min_y, max_y)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            keys = [key for key in self.cells if x0 <= key[0] <= x1 and y0 <= key[1] <= y1]
+        else:
+            keys = [(ix, iy) for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1)]
+
+        candidates = []
+        for key in keys:
+            bucket = self.cells.get(key)
+            if bucket is None:
+                continue
+            bottoms = self.cell_bottoms[key]
+            for i in range(bisect_right(bottoms, low_z), bisect_left(bottoms, high_z)):
+                index = bucket[i][1]
+                if index not in seen:
+                    seen.add(index)
+                    candidates.append(index)
+        candidates.extend(i for i in self.oversized if low_z < self.entries[i][5] < high_z)
+        self.tested += len(candidates)
+
+        for index in candidates:
+            entry = self.entries[index]
+            if entry[1] < max_x and entry[2] > min_x and entry[3] < max_y and entry[4] > min_y:
+                yield entry
+
+    def closest_below(self, item, bounds, distance_limit):
+        """Return the entry of the closest item below the (min_x, max_x, min_y, max_y, bottom_z) bounds."""
+        min_x, max_x, min_y, max_y, bottom_z = bounds
+
+        closest_entry = None
+        closest_distance = float('inf')
+        for entry in self.query(min_x, max_x, min_y, max_y, bottom_z - distance_limit, bottom_z):
+            distance = bottom_z - entry[5]
+            if entry[0] != item and distance < closest_distance:
+                closest_distance = distance
+                closest_entry = entry
+        return closest_entry
+
+class TriangleSurface:
+    """World-space triangles binned into a 2D grid, answering vertical "what is below this point" queries in bulk."""
+
+    max_cells_per_axis = 512
+    # Query points are processed in chunks to bound the size of the point/triangle pair arrays
+    chunk_size = 65536
+
+    def __init__(self, vertices, triangles, normals=None):
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        self._normals = None if normals is None else np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+
+        corners = self.vertices[self.triangles]
+        low = corners.min(axis=1)
+        high = corners.max(axis=1)
+        if len(self.triangles):
+            self.bounds = (low.min(axis=0), high.max(axis=0))
+        else:
+            self.bounds = (np.zeros(3), np.zeros(3))
+
+        origin = self.bounds[0][:2]
+        extent = self.bounds[1][:2] - origin
+        sizes = (high - low)[:, :2].max(axis=1) if len(self.triangles) else np.ones(1)
+        self.cell_size = max(float(np.median(sizes)), float(extent.max()) / self.max_cells_per_axis, 1e-6)
+        self.origin = origin
+        self.shape = (np.floor(extent / self.cell_size).astype(np.int64) + 1).tolist()
+
+        # Register every triangle in each cell its XY bounds touch, stored CSR style per cell
+        x0, y0 = self._cells(low[:, 0], low[:, 1])
+        x1, y1 = self._cells(high[:, 0], high[:, 1])
+        widths = x1 - x0 + 1
+        counts = widths * (y1 - y0 + 1)
+        triangle_ids = np.repeat(np.arange(len(self.triangles)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = np.repeat(x0, counts) + local % np.repeat(widths, counts)
+        cell_y = np.repeat(y0, counts) + local // np.repeat(widths, counts)
+        cell_ids = cell_y * self.shape[0] + cell_x
+
+        order = np.argsort(cell_ids, kind='stable')
+        self.cell_triangles = triangle_ids[order]
+        self.cell_start = np.searchsorted(cell_ids[order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def arrays(self):
+        """The surface as named arrays, enough to restore it with from_arrays without rebuilding the grid."""
+        return {
+            "vertices": self.vertices,
+            "triangles": self.triangles,
+            "normals": self.normals,
+            "bounds": np.array(self.bounds),
+            "grid": np.array([self.cell_size, self.origin[0], self.origin[1], self.shape[0], self.shape[1]]),
+            "cell_triangles": self.cell_triangles,
+            "cell_start": self.cell_start,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        surface = cls.__new__(cls)
+        surface.vertices = arrays["vertices"]
+        surface.triangles = arrays["triangles"]
+        surface._normals = arrays["normals"]
+        surface.bounds = (arrays["bounds"][0], arrays["bounds"][1])
+        cell_size, origin_x, origin_y, shape_x, shape_y = arrays["grid"].tolist()
+        surface.cell_size = cell_size
+        surface.origin = np.array([origin_x, origin_y])
+        surface.shape = [int(shape_x), int(shape_y)]
+        surface.cell_triangles = arrays["cell_triangles"]
+        surface.cell_start = arrays["cell_start"]
+        return surface
+
+    def _cells(self, x, y):
+        cx = np.clip(np.floor((x - self.origin[0]) / self.cell_size).astype(np.int64), 0, self.shape[0] - 1)
+        cy = np.clip(np.floor((y - self.origin[1]) / self.cell_size).astype(np.int64), 0, self.shape[1] - 1)
+        return cx, cy
+
+    @property
+    def normals(self):
+        if self._normals is None:
+            a, b, c = (self.vertices[self.triangles[:, i]] for i in range(3))
+            normals = np.cross(b - a, c - a)
+            lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+            self._normals = normals / np.where(lengths > 0, lengths, 1)
+        return self._normals
+
+    def drop(self, x, y, start_z, reach):
+        """Highest surface Z at or below start_z and within reach of it for every (x, y) point.
+
+        Returns (heights, triangle indices), with NaN and -1 where nothing was hit.
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        start_z = np.broadcast_to(np.asarray(start_z, dtype=np.float64), x.shape)
+        reach = np.broadcast_to(np.asarray(reach, dtype=np.float64), x.shape)
+
+        heights = np.full(len(x), np.nan)
+        hit_triangles = np.full(len(x), -1, dtype=np.int64)
+        for start in range(0, len(x), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            self._drop_chunk(x[chunk], y[chunk], start_z[chunk], reach[chunk], heights[chunk], hit_triangles[chunk])
+        return heights, hit_triangles
+
+    def _drop_chunk(self, x, y, start_z, reach, heights, hit_triangles):
+        low, high = self.bounds
+        inside = (x >= low[0]) & (x <= high[0]) & (y >= low[1]) & (y <= high[1])
+        cx, cy = self._cells(x, y)
+        cells = cy * self.shape[0] + cx
+        starts = self.cell_start[cells]
+        counts = np.where(inside, self.cell_start[cells + 1] - starts, 0)
+        if not counts.any():
+            return
+
+        points = np.repeat(np.arange(len(x)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        triangles = self.cell_triangles[np.repeat(starts, counts) + local]
+
+        # Barycentric coordinates of the point in the triangle's XY projection
+        corners = self.vertices[self.triangles[triangles]]
+        a = corners[:, 0]
+        edge_1 = corners[:, 1] - a
+        edge_2 = corners[:, 2] - a
+        px = x[points] - a[:, 0]
+        py = y[points] - a[:, 1]
+        det = edge_1[:, 0] * edge_2[:, 1] - edge_2[:, 0] * edge_1[:, 1]
+        safe_det = np.where(det != 0, det, 1)
+        u = (px * edge_2[:, 1] - edge_2[:, 0] * py) / safe_det
+        v = (edge_1[:, 0] * py - px * edge_1[:, 1]) / safe_det
+        z = a[:, 2] + u * edge_1[:, 2] + v * edge_2[:, 2]
+
+        eps = 1e-9
+        top = start_z[points]
+        hit = ((det != 0) & (u >= -eps) & (v >= -eps) & (u + v <= 1 + eps)
+               & (z <= top) & (z >= top - reach[points]))
+        if not hit.any():
+            return
+
+        # Keep the highest hit of every point
+        points, z, triangles = points[hit], z[hit], triangles[hit]
+        order = np.lexsort((z, points))
+        points, z, triangles = points[order], z[order], triangles[order]
+        last = np.append(points[1:] != points[:-1], True)
+        heights[points[last]] = z[last]
+        hit_triangles[points[last]] = triangles[last]
+
+class HeightField:
+    """A terrain surface rasterized once into a regular grid of heights, answering drops with bilinear lookups.
+
+    It offers the bounds, normals and drop interface of TriangleSurface. The triangle indices it hands out are
+    grid cell indices into normals.
+    """
+
+    def __init__(self, surface, resolution):
+        low, high = surface.bounds
+        self.bounds = surface.bounds
+        self.resolution = resolution
+        # Sample just inside the bounds so the border rows still hit the outermost triangles
+        inset = np.maximum(high[:2] - low[:2], 1e-6) * 1e-6
+        xs = np.linspace(low[0] + inset[0], high[0] - inset[0], resolution + 1)
+        ys = np.linspace(low[1] + inset[1], high[1] - inset[1], resolution + 1)
+        self.origin = np.array([xs[0], ys[0]])
+        self.cell_size = np.maximum(np.array([xs[-1] - xs[0], ys[-1] - ys[0]]) / resolution, 1e-12)
+
+        gx, gy = np.meshgrid(xs, ys, indexing='ij')
+        count = gx.size
+        heights, _ = surface.drop(gx.ravel(), gy.ravel(), np.full(count, high[2]), np.full(count, high[2] - low[2] + 1))
+        self.heights = heights.reshape(resolution + 1, resolution + 1)
+
+        # One normal per cell from the slopes between its corner heights
+        h = self.heights
+        dzdx = (h[1:, :-1] - h[:-1, :-1] + h[1:, 1:] - h[:-1, 1:]) / (2 * self.cell_size[0])
+        dzdy = (h[:-1, 1:] - h[:-1, :-1] + h[1:, 1:] - h[1:, :-1]) / (2 * self.cell_size[1])
+        normals = np.column_stack((-dzdx.ravel(), -dzdy.ravel(), np.ones(dzdx.size)))
+        self.normals = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+    def arrays(self):
+        """The height grid as named arrays, enough to restore it with from_arrays without rasterizing again."""
+        return {
+            "bounds": np.array(self.bounds),
+            "grid": np.array([self.resolution, self.origin[0], self.origin[1], self.cell_size[0], self.cell_size[1]]),
+            "heights": self.heights,
+            "normals": self.normals,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        field = cls.__new__(cls)
+        field.bounds = (arrays["bounds"][0], arrays["bounds"][1])
+        resolution, origin_x, origin_y, cell_x, cell_y = arrays["grid"].tolist()
+        field.resolution = int(resolution)
+        field.origin = np.array([origin_x, origin_y])
+        field.cell_size = np.array([cell_x, cell_y])
+        field.heights = arrays["heights"]
+        field.normals = arrays["normals"]
+        return field
+
+    @staticmethod
+    def suitable(surface):
+        """Whether a surface looks like a terrain, with one height per XY: no faces standing up or facing away."""
+        normal_z = surface.normals[:, 2]
+        return bool(len(normal_z)) and bool(np.all(normal_z > 1e-3) or np.all(normal_z < -1e-3))
+
+    def drop(self, x, y, start_z, reach):
+        """Interpolated height at every (x, y) point, NaN outside the terrain or out of the start_z/reach range.
+
+        Returns (heights, cell indices) with -1 cells where nothing was hit.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        start_z = np.broadcast_to(np.asarray(start_z, dtype=np.float64), x.shape)
+        reach = np.broadcast_to(np.asarray(reach, dtype=np.float64), x.shape)
+        resolution = self.resolution
+
+        fx = (x - self.origin[0]) / self.cell_size[0]
+        fy = (y - self.origin[1]) / self.cell_size[1]
+        inside = (fx >= 0) & (fx <= resolution) & (fy >= 0) & (fy <= resolution)
+        ix = np.clip(np.floor(fx).astype(np.int64), 0, resolution - 1)
+        iy = np.clip(np.floor(fy).astype(np.int64), 0, resolution - 1)
+        tx = np.clip(fx - ix, 0, 1)
+        ty = np.clip(fy - iy, 0, 1)
+
+        h = self.heights
+        z = ((h[ix, iy] * (1 - tx) + h[ix + 1, iy] * tx) * (1 - ty)
+             + (h[ix, iy + 1] * (1 - tx) + h[ix + 1, iy + 1] * tx) * ty)
+        hit = inside & ~np.isnan(z) & (z <= start_z) & (z >= start_z - reach)
+        return np.where(hit, z, np.nan), np.where(hit, ix * resolution + iy, -1)
+
+# File layout of write_arrays: magic, header length, JSON header, then every array aligned to this many bytes
+ARRAYS_MAGIC = b"SNAPARR1"
+ARRAYS_ALIGNMENT = 64
+
+def write_arrays(path, arrays):
+    """Write named arrays into one file that map_arrays can memory-map, replacing the file atomically."""
+    header = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        header[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ARRAYS_ALIGNMENT) * ARRAYS_ALIGNMENT
+    text = json.dumps(header).encode()
+    data_start = -(-(len(ARRAYS_MAGIC) + 8 + len(text)) // ARRAYS_ALIGNMENT) * ARRAYS_ALIGNMENT
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(ARRAYS_MAGIC)
+        f.write(len(text).to_bytes(8, "little"))
+        f.write(text)
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(temporary, path)
+
+def map_arrays(path):
+    """Memory-map the arrays of a file written by write_arrays, read-only. Raises ValueError on a foreign file."""
+    with open(path, "rb") as f:
+        if f.read(len(ARRAYS_MAGIC)) != ARRAYS_MAGIC:
+            raise ValueError(f"{path} is not an arrays file")
+        length = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(length))
+    data_start = -(-(len(ARRAYS_MAGIC) + 8 + length) // ARRAYS_ALIGNMENT) * ARRAYS_ALIGNMENT
+
+    arrays = {}
+    for name, entry in header.items():
+        shape = tuple(entry["shape"])
+        if not math.prod(shape):
+            # Empty arrays can't be mapped
+            arrays[name] = np.empty(shape, dtype=entry["dtype"])
+            continue
+        arrays[name] = np.memmap(path, dtype=entry["dtype"], mode="r", offset=data_start + entry["offset"],
+                                 shape=shape)
+    return arrays
+
+def cluster_vertices(vertices, triangles, tolerance):
+    """Decimate triangles by merging all vertices that share a tolerance-sized grid cell into their mean.
+
+    Every surviving vertex moves by less than a cell diagonal. Triangles that collapse are dropped.
+    Returns (vertices, triangles).
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    _, cluster = np.unique(np.floor(vertices / tolerance).astype(np.int64), axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    counts = np.bincount(cluster).astype(np.float64)
+    merged = np.column_stack([np.bincount(cluster, weights=vertices[:, axis]) / counts for axis in range(3)])
+
+    triangles = cluster[triangles]
+    keep = ((triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2])
+            & (triangles[:, 0] != triangles[:, 2]))
+    return merged, triangles[keep]
+
+def surface_supports(surfaces, candidates, origins, reach):
+    """Cast every object's ray down onto its candidate surfaces, querying each surface once for all its objects.
+
+    surfaces maps a key to a TriangleSurface and candidates lists the surface keys to test per object.
+    Returns (support heights, supporting keys, triangle indices) with NaN, None and -1 where nothing was hit.
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    reach = np.broadcast_to(np.asarray(reach, dtype=np.float64), len(origins))
+    supports = np.full(len(origins), np.nan)
+    floors = [None] * len(origins)
+    triangles = np.full(len(origins), -1, dtype=np.int64)
+
+    rows_by_surface = {}
+    for row, keys in enumerate(candidates):
+        for key in keys:
+            rows_by_surface.setdefault(key, []).append(row)
+
+    for key, rows in rows_by_surface.items():
+        rows = np.array(rows)
+        heights, hit_triangles = surfaces[key].drop(origins[rows, 0], origins[rows, 1], origins[rows, 2], reach[rows])
+        # The highest hit is the first surface the downward ray meets
+        better = ~np.isnan(heights) & ~(heights <= supports[rows])
+        rows = rows[better]
+        supports[rows] = heights[better]
+        triangles[rows] = hit_triangles[better]
+        for row in rows.tolist():
+            floors[row] = key
+    return supports, floors, triangles
+
+def stack_supports(boxes, base, distance_limit, gap_offset, settled=None, max_cells_per_entry=64):
+    """Settle boxes bottom-up so each rests on the highest of its base support and the boxes settled under it.
+
+    boxes are world box rows and base holds the support height under each box from the rest of the scene, NaN
+    where there is none. settled holds boxes already at their final place, such as those of an earlier run. A
+    settled box counts as support when its footprint overlaps and its original bottom was at most distance_limit
+    below the box's own. Returns (support heights, row of the supporting box or -1), where rows from len(boxes) on
+    refer to the settled boxes.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+    supports = np.array(base, dtype=np.float64).reshape(-1)
+    support_rows = np.full(len(boxes), -1, dtype=np.int64)
+    if not len(boxes):
+        return supports, support_rows
+    count = len(boxes)
+    if settled is not None:
+        boxes = np.vstack((boxes, np.asarray(settled, dtype=np.float64).reshape(-1, 6)))
+
+    widths = np.maximum(boxes[:count, 3] - boxes[:count, 0], boxes[:count, 4] - boxes[:count, 1])
+    cell_size = max(float(np.median(widths)), 1e-3)
+    cells = np.floor(boxes[:, [0, 3, 1, 4]] / cell_size).astype(np.int64).tolist()
+    heights = (boxes[:, 5] - boxes[:, 2]).tolist()
+    footprints = boxes[:, [0, 3, 1, 4, 2]].tolist()
+
+    # Cell -> settled (negated top, row) pairs, so the highest top comes first
+    grid = {}
+    oversized = []
+
+    def insert(row, top):
+        x0, x1, y0, y1 = cells[row]
+        pair = (-top, row)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > max_cells_per_entry:
+            insort(oversized, pair)
+        else:
+            for ix in range(x0, x1 + 1):
+                for iy in range(y0, y1 + 1):
+                    insort(grid.setdefault((ix, iy), []), pair)
+
+    for row in range(count, len(boxes)):
+        insert(row, float(boxes[row, 5]))
+
+    for row in np.argsort(boxes[:count, 2], kind="stable").tolist():
+        min_x, max_x, min_y, max_y, bottom = footprints[row]
+        x0, x1, y0, y1 = cells[row]
+        best = -math.inf if math.isnan(supports[row]) else supports[row]
+
+        buckets = [grid.get((ix, iy), ()) for ix in range(x0, x1 + 1) for iy in range(y0, y1 + 1)]
+        buckets.append(oversized)
+        for bucket in buckets:
+            for neg_top, other in bucket:
+                if -neg_top <= best:
+                    break
+                o_min_x, o_max_x, o_min_y, o_max_y, o_bottom = footprints[other]
+                if (o_min_x < max_x and o_max_x > min_x and o_min_y < max_y and o_max_y > min_y
+                        and o_bottom > bottom - distance_limit):
+                    best = -neg_top
+                    support_rows[row] = other
+                    break
+
+        if best > -math.inf:
+            supports[row] = best
+        settled_bottom = best + gap_offset if best > -math.inf else bottom
+        insert(row, settled_bottom + heights[row])
+    return supports, support_rows
+
+def sweep_and_prune(boxes, active=None):
+    """Pairs of rows (first, second) of the (n, 6) boxes whose XY footprints overlap, found by sorting on min X.
+
+    With an active mask only pairs that involve at least one active box are returned, so a large set of static
+    boxes costs no more than the sort.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+    count = len(boxes)
+    active = np.ones(count, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+    order = np.argsort(boxes[:, 0], kind="stable")
+    sorted_min_x = boxes[order, 0]
+    positions = np.arange(count)
+    # Boxes after position p in the sweep start before p's box ends, up to this position
+    ends = np.searchsorted(sorted_min_x, boxes[order, 3], side="left")
+
+    # Active boxes pair with every box in their sweep range, static ones only with the active boxes in it
+    sorted_active = active[order]
+    active_positions = np.flatnonzero(sorted_active)
+    firsts = np.where(sorted_active, positions + 1, np.searchsorted(active_positions, positions, side="right"))
+    lasts = np.where(sorted_active, ends, np.searchsorted(active_positions, ends, side="left"))
+    counts = np.maximum(lasts - firsts, 0)
+    total = int(counts.sum())
+
+    owners = np.repeat(positions, counts)
+    steps = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    others = np.repeat(firsts, counts) + steps
+    others = np.where(sorted_active[owners], others, active_positions[np.minimum(others, len(active_positions) - 1)])
+
+    first, second = order[owners], order[others]
+    # Boxes that only touch don't overlap
+    overlap = (boxes[first, 1] < boxes[second, 4]) & (boxes[second, 1] < boxes[first, 4])
+    return first[overlap], second[overlap]
+
+def resolve_overlaps(boxes, movable, pairs, points, owners, surfaces, tolerance=1e-6):
+    """Lift movable boxes, lowest first, until none of them intersects a box it is paired with.
+
+    boxes are (n, 6) world boxes and points the support points of each row, with their row in owners, sorted by
+    owner. surfaces maps rows to (world TriangleSurface, Z offset of the row since the surface was built); rows
+    without one are tested as their box. A pair counts as intersecting when a point of one row lies inside the other,
+    or when the other has no surface and the boxes overlap, and the lower row is then lifted onto the other's top
+    under its points. Rows that cross without a point of either inside the other's footprint are tested at a grid
+    of points over the footprint intersection. Points on the boundary of the other row's footprint don't count, so
+    neighbours that only touch stay where they are. Returns the lift of every row.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+    count = len(boxes)
+    lifts = np.zeros(count)
+    settled = ~np.asarray(movable, dtype=bool)
+    first, second = (np.asarray(rows, dtype=np.int64) for rows in pairs)
+    starts = np.searchsorted(owners, np.arange(count), side="left")
+    ends = np.searchsorted(owners, np.arange(count), side="right")
+
+    # Neighbour lists in both directions
+    rows = np.concatenate((first, second))
+    neighbours = np.concatenate((second, first))
+    order = np.argsort(rows, kind="stable")
+    neighbours = neighbours[order]
+    bounds = np.searchsorted(rows[order], np.arange(count + 1))
+
+    def row_points(row):
+        return points[starts[row]:ends[row]] + (0, 0, lifts[row])
+
+    def points_over(row, xy):
+        """Which points lie strictly inside the row's XY footprint, by more than the tolerance."""
+        box = boxes[row]
+        return ((xy[:, 0] > box[0] + tolerance) & (xy[:, 0] < box[3] - tolerance)
+                & (xy[:, 1] > box[1] + tolerance) & (xy[:, 1] < box[4] - tolerance))
+
+    def footprint_samples(row, other, z, samples=4):
+        """A samples x samples grid of points at height z over the footprint intersection of two rows."""
+        min_x, min_y = np.maximum(boxes[row, :2], boxes[other, :2])
+        max_x, max_y = np.minimum(boxes[row, 3:5], boxes[other, 3:5])
+        if min_x >= max_x - tolerance or min_y >= max_y - tolerance:
+            return np.empty((0, 3))
+        steps = (np.arange(samples) + 0.5) / samples
+        x, y = np.meshgrid(min_x + (max_x - min_x) * steps, min_y + (max_y - min_y) * steps)
+        return np.column_stack((x.ravel(), y.ravel(), np.full(x.size, z)))
+
+    def lift_onto(row, other):
+        """How far row has to rise to clear other, 0 when they don't really intersect."""
+        low, high = boxes[row, 2] + lifts[row], boxes[row, 5] + lifts[row]
+        other_low, other_high = boxes[other, 2] + lifts[other], boxes[other, 5] + lifts[other]
+        rise = 0.0
+
+        own = row_points(row)
+        theirs = row_points(other)
+        own = own[points_over(other, own)]
+        theirs_over = points_over(row, theirs)
+        if not len(own) and not theirs_over.any():
+            # Crossed planks or fence rails overlap without a point of either inside the other's footprint, so the
+            # intersection of the footprints is sampled at this row's underside instead
+            own = footprint_samples(row, other, low)
+
+        if other in surfaces:
+            surface, offset = surfaces[other]
+            offset = offset + lifts[other]
+            hits, _ = surface.drop(own[:, 0], own[:, 1], high - offset, high - low + tolerance)
+            if np.any(hits + offset > own[:, 2] + tolerance):
+                # Intersecting, so every point has to clear the other's top
+                tops, _ = surface.drop(own[:, 0], own[:, 1], other_high - offset + tolerance,
+                                       other_high - other_low + 2 * tolerance)
+                rise = max(rise, float(np.nanmax(tops + offset - own[:, 2], initial=0.0)))
+        else:
+            # Without a surface the other is solid as its box, and the caller already found the Z ranges overlapping
+            other_box = boxes[other]
+            if (other_box[0] < boxes[row, 3] - tolerance and boxes[row, 0] < other_box[3] - tolerance
+                    and other_box[1] < boxes[row, 4] - tolerance and boxes[row, 1] < other_box[4] - tolerance):
+                rise = max(rise, other_high - low)
+
+        # Points of the other row poking up into this one's box, its underside taken as the box bottom
+        inside = theirs_over & (theirs[:, 2] > low + tolerance) & (theirs[:, 2] < high)
+        if inside.any():
+            rise = max(rise, float(theirs[inside, 2].max()) - low)
+        return rise
+
+    for row in np.flatnonzero(~settled)[np.argsort(boxes[~settled, 2], kind="stable")].tolist():
+        others = neighbours[bounds[row]:bounds[row + 1]].tolist()
+        # Every lift lands the row on top of one neighbour, so this many passes always settle it
+        for _ in range(len(others) + 1):
+            low, high = boxes[row, 2] + lifts[row], boxes[row, 5] + lifts[row]
+            rise = 0.0
+            for other in others:
+                if (settled[other] and boxes[other, 5] + lifts[other] > low + tolerance
+                        and boxes[other, 2] + lifts[other] < high - tolerance):
+                    rise = max(rise, lift_onto(row, other))
+            if rise <= tolerance:
+                break
+            lifts[row] += rise
+        settled[row] = True
+    return lifts
+
+def support_points(vertices, directions=256):
+    """Indices of the vertices that are extreme along one of a fixed set of directions spread over the sphere.
+
+    The lowest point of the mesh under any rotation or scale is one of these or lies close to one, so this reduced
+    set can stand in for every vertex when looking for contacts.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    if len(vertices) <= directions:
+        return np.arange(len(vertices))
+
+    # Fibonacci sphere, evenly spaced directions without clustering at the poles
+    k = np.arange(directions) + 0.5
+    z = 1 - 2 * k / directions
+    radius = np.sqrt(1 - z * z)
+    angle = np.pi * (3 - np.sqrt(5)) * k
+    sphere = np.column_stack((radius * np.cos(angle), radius * np.sin(angle), z))
+
+    centered = vertices - vertices.mean(axis=0)
+    extremes = [np.argmin(centered[start:start + 4096] @ sphere.T, axis=0) + start
+                for start in range(0, len(centered), 4096)]
+    if len(extremes) > 1:
+        candidates = np.unique(np.concatenate(extremes))
+        extremes = [candidates[np.argmin(centered[candidates] @ sphere.T, axis=0)]]
+    return np.unique(extremes[0])
+
+def drop_points(surfaces, candidates, points, owners, start_z, reach):
+    """Drop every point onto the candidate surfaces of its owner, querying each surface once for all its points.
+
+    start_z and reach are given per owner. Returns (heights, floors, triangles) per point for the highest hit,
+    with NaN, None and -1 where nothing was hit.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    owners = np.asarray(owners, dtype=np.int64)
+    start_z = np.broadcast_to(np.asarray(start_z, dtype=np.float64), len(candidates))
+    reach = np.broadcast_to(np.asarray(reach, dtype=np.float64), len(candidates))
+    heights = np.full(len(points), np.nan)
+    floors = [None] * len(points)
+    triangles = np.full(len(points), -1, dtype=np.int64)
+
+    order = np.argsort(owners, kind='stable')
+    starts = np.searchsorted(owners[order], np.arange(len(candidates) + 1))
+
+    rows_by_surface = {}
+    for row, keys in enumerate(candidates):
+        for key in keys:
+            rows_by_surface.setdefault(key, []).append(row)
+
+    for key, rows in rows_by_surface.items():
+        rows = np.array(rows)
+        counts = starts[rows + 1] - starts[rows]
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        selected = order[np.repeat(starts[rows], counts) + local]
+        hit_heights, hit_triangles = surfaces[key].drop(points[selected, 0], points[selected, 1],
+                                                        np.repeat(start_z[rows], counts),
+                                                        np.repeat(reach[rows], counts))
+        # The highest hit is the first surface the downward ray meets
+        better = ~np.isnan(hit_heights) & ~(hit_heights <= heights[selected])
+        selected = selected[better]
+        heights[selected] = hit_heights[better]
+        triangles[selected] = hit_triangles[better]
+        for i in selected.tolist():
+            floors[i] = key
+    return heights, floors, triangles
+
+def best_per_owner(values, owners, count, largest=False):
+    """Index of the smallest (or largest) non-NaN value of each owner, -1 for owners without any."""
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(values))
+    best = np.full(count, -1, dtype=np.int64)
+    if not len(valid):
+        return best
+    order = valid[np.lexsort((-values[valid] if largest else values[valid], owners[valid]))]
+    first = order[np.append(True, owners[order][1:] != owners[order][:-1])]
+    best[owners[first]] = first
+    return best
+
+def contact_supports(surfaces, candidates, points, owners, bottoms, start_z, reach):
+    """Rest objects on their closest contact point instead of their box bottom.
+
+    points are world-space support points and owners the object row of each. Every point is dropped from its
+    object's start_z onto the object's candidate surfaces. The support of an object is its box bottom minus the
+    smallest point-to-surface gap, so landing the box bottom on it brings the closest point onto the floor.
+    Returns (support heights, supporting keys, triangle indices) like surface_supports.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    owners = np.asarray(owners, dtype=np.int64)
+    heights, floors, triangles = drop_points(surfaces, candidates, points, owners, start_z, reach)
+    best = best_per_owner(points[:, 2] - heights, owners, len(candidates))
+
+    found = best >= 0
+    supports = np.full(len(candidates), np.nan)
+    supports[found] = np.asarray(bottoms, dtype=np.float64)[found] - (points[best[found], 2] - heights[best[found]])
+    return supports, [floors[i] if i >= 0 else None for i in best.tolist()], np.where(found, triangles[best], -1)
+
+def footprint_supports(surfaces, candidates, boxes, samples, reach, combine='MAX', level=True):
+    """Cast a samples x samples grid of downward rays over each box footprint and combine the hits per box.
+
+    Rays start at the box centers. 'MAX' rests each box on its highest hit. 'PLANE' fits a plane through the hits
+    and uses its height at the footprint center, or at its highest footprint corner when level is True so a box
+    that is not tilted doesn't cut into the slope. Boxes with fewer than three hits fall back to 'MAX'.
+    Returns (supports, floors, triangles, plane normals), the floor and triangle being those of the highest hit,
+    and the normals NaN where no plane was fitted.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+    count = len(boxes)
+    steps = (np.arange(samples) + 0.5) / samples
+    u, v = (grid.ravel() for grid in np.meshgrid(steps, steps))
+    owners = np.repeat(np.arange(count), len(u))
+    x = (boxes[:, 0, None] + (boxes[:, 3] - boxes[:, 0])[:, None] * u).ravel()
+    y = (boxes[:, 1, None] + (boxes[:, 4] - boxes[:, 1])[:, None] * v).ravel()
+    start_z = (boxes[:, 2] + boxes[:, 5]) / 2
+    points = np.column_stack((x, y, np.repeat(start_z, len(u))))
+
+    heights, floors, triangles = drop_points(surfaces, candidates, points, owners, start_z, reach)
+    best = best_per_owner(heights, owners, count, largest=True)
+    found = best >= 0
+    supports = np.where(found, heights[best], np.nan)
+    normals = np.full((count, 3), np.nan)
+
+    if combine == 'PLANE':
+        hit = ~np.isnan(heights)
+        hits_per_owner = np.bincount(owners[hit], minlength=count)
+        # Least squares z = a x + b y + c per box, solved from the summed normal equations
+        dx = np.where(hit, x - np.repeat((boxes[:, 0] + boxes[:, 3]) / 2, len(u)), 0)
+        dy = np.where(hit, y - np.repeat((boxes[:, 1] + boxes[:, 4]) / 2, len(u)), 0)
+        dz = np.where(hit, heights, 0)
+        one = hit.astype(np.float64)
+        terms = [dx * dx, dx * dy, dx, dy * dy, dy, one, dx * dz, dy * dz, dz]
+        sums = np.column_stack([np.bincount(owners, weights=term, minlength=count) for term in terms])
+        matrices = sums[:, [0, 1, 2, 1, 3, 4, 2, 4, 5]].reshape(-1, 3, 3)
+        fitted = (hits_per_owner >= 3) & (np.abs(np.linalg.det(matrices)) > 1e-12)
+        if fitted.any():
+            a, b, c = np.linalg.solve(matrices[fitted], sums[fitted][:, 6:9, None])[:, :, 0].T
+            normal = np.column_stack((-a, -b, np.ones_like(a)))
+            normals[fitted] = normal / np.linalg.norm(normal, axis=1, keepdims=True)
+            if level:
+                half_x = (boxes[fitted, 3] - boxes[fitted, 0]) / 2
+                half_y = (boxes[fitted, 4] - boxes[fitted, 1]) / 2
+                c = c + np.abs(a) * half_x + np.abs(b) * half_y
+            supports[fitted] = c
+
+    return supports, [floors[i] if i >= 0 else None for i in best.tolist()], np.where(found, triangles[best], -1), normals
+
+def grid_clusters(xy, cell_size):
+    """Cluster label per point, one cluster per occupied square cell of the given size."""
+    cells = np.floor(np.asarray(xy, dtype=np.float64).reshape(-1, 2) / cell_size).astype(np.int64)
+    if not len(cells):
+        return np.empty(0, dtype=np.int64)
+    return np.unique(cells, axis=0, return_inverse=True)[1].reshape(-1)
+
+def kmeans_clusters(xy, count, iterations=25, rng=None):
+    """Cluster label per point from k-means with k-means++ seeding, empty clusters dropped."""
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    count = min(count, len(xy))
+    if count <= 1:
+        return np.zeros(len(xy), dtype=np.int64)
+    rng = rng or np.random.default_rng()
+
+    centers = [xy[rng.integers(len(xy))]]
+    distances = ((xy - centers[0]) ** 2).sum(axis=1)
+    for _ in range(count - 1):
+        total = distances.sum()
+        choice = rng.choice(len(xy), p=distances / total) if total > 0 else rng.integers(len(xy))
+        centers.append(xy[choice])
+        distances = np.minimum(distances, ((xy - xy[choice]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = np.argmin(((xy[:, None, :] - centers[None]) ** 2).sum(axis=2), axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        sizes = np.bincount(labels, minlength=count)
+        for axis in range(2):
+            sums = np.bincount(labels, weights=xy[:, axis], minlength=count)
+            centers[:, axis] = np.where(sizes > 0, sums / np.maximum(sizes, 1), centers[:, axis])
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+def landing_heights(supports, half_z, gap_offset):
+    """Z locations that rest objects of the given half heights on their support heights."""
+    return supports + half_z + gap_offset
+
+def randomize_rotations(rotations, mask, axes, rng=None):
+    """Add a uniform random turn in [-180, 180) degrees around each enabled (x, y, z) axis of the masked rows."""
+    rng = rng or np.random.default_rng()
+    count = np.count_nonzero(mask)
+    for axis, enabled in enumerate(axes):
+        if enabled:
+            rotations[mask, axis] += np.radians(rng.uniform(-180, 180, count))
+    return rotations
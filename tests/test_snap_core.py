@@ -0,0 +1,276 @@
+"""Behaviour tests for snap_core, which runs without Blender.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+import snap_core
+
+def cube_mesh(x=0.0, y=0.0, z=0.0, size=1.0):
+    """Vertices and triangles of an axis-aligned cube with its minimum corner at (x, y, z)."""
+    vertices = np.array([[x + dx, y + dy, z + dz] for dz in (0, size) for dy in (0, size) for dx in (0, size)])
+    triangles = np.array([[0, 1, 3], [0, 3, 2], [4, 5, 7], [4, 7, 6], [0, 1, 5], [0, 5, 4],
+                          [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 3, 7], [1, 7, 5]])
+    return vertices, triangles
+
+def grid_mesh(height, size=10.0, resolution=40):
+    """Triangulated grid over [0, size] squared with Z from height(x, y)."""
+    steps = np.linspace(0, size, resolution + 1)
+    x, y = np.meshgrid(steps, steps)
+    vertices = np.column_stack((x.ravel(), y.ravel(), height(x, y).ravel()))
+    row = resolution + 1
+    corner = (np.arange(resolution)[:, None] * row + np.arange(resolution)[None, :]).ravel()
+    triangles = np.vstack((np.column_stack((corner, corner + 1, corner + row + 1)),
+                           np.column_stack((corner, corner + row + 1, corner + row))))
+    return vertices, triangles
+
+def box(min_x, min_y, min_z, max_x, max_y, max_z):
+    return [min_x, min_y, min_z, max_x, max_y, max_z]
+
+def box_points(boxes):
+    """Corner points of world box rows with their owners, as resolve_overlaps takes them."""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    points = [[(row[i], row[j], row[k]) for i in (0, 3) for j in (1, 4) for k in (2, 5)] for row in boxes]
+    return np.array(points).reshape(-1, 3), np.repeat(np.arange(len(boxes)), 8)
+
+def pair_set(pairs):
+    return {tuple(sorted(pair)) for pair in zip(*(rows.tolist() for rows in pairs))}
+
+def test_stats_accumulate_phases_and_counters():
+    stats = snap_core.SnapStats()
+    for _ in range(2):
+        with stats.phase("search"):
+            stats.count("rays", 3)
+    assert list(stats.phases) == ["search"]
+    assert stats.counters == {"rays": 6}
+    assert stats.total == pytest.approx(stats.phases["search"])
+    assert stats.summary().endswith("rays 6")
+
+def test_stats_total_counts_nested_phases_once():
+    stats = snap_core.SnapStats()
+    with stats.phase("search"):
+        with stats.phase("contact_points"):
+            time.sleep(0.01)
+    assert stats.phases["contact_points"] <= stats.phases["search"]
+    assert stats.total == pytest.approx(stats.phases["search"])
+
+def test_world_boxes_follow_rotation_and_translation():
+    corners = np.array([[[x, y, z] for x in (-1, 1) for y in (-2, 2) for z in (0, 1)]], dtype=np.float64)
+    matrix = np.array([[0, -1, 0, 10], [1, 0, 0, 0], [0, 0, 1, 5], [0, 0, 0, 1]], dtype=np.float64)
+    np.testing.assert_allclose(snap_core.world_boxes(corners, matrix[None]), [[8, -1, 5, 12, 1, 6]])
+
+def test_footprint_index_finds_closest_below():
+    entries = [("floor", -10, 10, -10, 10, -1, 0), ("crate", 0, 1, 0, 1, 0, 1), ("far", 5, 6, 5, 6, 0, 1)]
+    index = snap_core.FootprintIndex(entries)
+    assert index.closest_below("box", (0.2, 0.8, 0.2, 0.8, 3), 10)[0] == "crate"
+    assert index.closest_below("box", (0.2, 0.8, 0.2, 0.8, 3), 2.5) is None
+    assert {entry[0] for entry in index.query(4, 7, 4, 7, -5, 5)} == {"floor", "far"}
+
+def test_footprint_index_update_moves_entry():
+    index = snap_core.FootprintIndex([("crate", 0, 1, 0, 1, 0, 1)])
+    index.update("crate", (20, 21, 20, 21, 0, 1))
+    assert list(index.query(0, 1, 0, 1, -5, 5)) == []
+    assert [entry[0] for entry in index.query(20, 21, 20, 21, -5, 5)] == ["crate"]
+
+def test_triangle_surface_drop_hits_highest_face_within_reach():
+    surface = snap_core.TriangleSurface(*cube_mesh())
+    heights, triangles = surface.drop([0.5, 0.5, 3.0], [0.5, 0.5, 3.0], [5.0, 0.5, 5.0], [10.0, 10.0, 10.0])
+    np.testing.assert_allclose(heights[:2], [1.0, 0.0])
+    assert np.isnan(heights[2]) and triangles[2] == -1
+    assert np.isnan(surface.drop([0.5], [0.5], 5.0, 1.0)[0][0])
+
+def test_triangle_surface_drop_interpolates_slope():
+    surface = snap_core.TriangleSurface(*grid_mesh(lambda x, y: 0.2 * x))
+    x = np.array([1.0, 4.5, 9.0])
+    heights, _ = surface.drop(x, np.full(3, 5.0), 10.0, 20.0)
+    np.testing.assert_allclose(heights, 0.2 * x)
+    np.testing.assert_allclose(surface.normals[:, 2], np.full(len(surface.normals), 1 / np.hypot(1, 0.2)))
+
+def test_surface_supports_take_the_highest_candidate():
+    surfaces = {"ground": snap_core.TriangleSurface(*grid_mesh(lambda x, y: np.zeros_like(x))),
+                "crate": snap_core.TriangleSurface(*cube_mesh(2, 2))}
+    origins = [[2.5, 2.5, 5], [7, 7, 5], [2.5, 2.5, 5], [50, 50, 5]]
+    candidates = [["ground", "crate"], ["ground", "crate"], ["ground"], ["ground"]]
+    supports, floors, triangles = snap_core.surface_supports(surfaces, candidates, origins, 10.0)
+    np.testing.assert_allclose(supports[:3], [1, 0, 0])
+    assert np.isnan(supports[3])
+    assert floors == ["crate", "ground", "ground", None]
+    assert triangles[3] == -1 and np.all(triangles[:3] >= 0)
+
+def test_heightfield_matches_surface_and_rejects_closed_meshes():
+    surface = snap_core.TriangleSurface(*grid_mesh(lambda x, y: np.sin(x) * np.cos(y)))
+    assert snap_core.HeightField.suitable(surface)
+    assert not snap_core.HeightField.suitable(snap_core.TriangleSurface(*cube_mesh()))
+
+    field = snap_core.HeightField(surface, 256)
+    x, y = np.random.default_rng(0).uniform(0.5, 9.5, (2, 200))
+    expected, _ = surface.drop(x, y, 5.0, 10.0)
+    heights, cells = field.drop(x, y, 5.0, 10.0)
+    np.testing.assert_allclose(heights, expected, atol=0.01)
+    assert np.all(field.normals[cells][:, 2] > 0)
+
+def test_arrays_round_trip_through_memory_map(tmp_path):
+    surface = snap_core.TriangleSurface(*grid_mesh(lambda x, y: 0.1 * x * y))
+    path = str(tmp_path / "surface.snap")
+    snap_core.write_arrays(path, surface.arrays())
+    restored = snap_core.TriangleSurface.from_arrays(snap_core.map_arrays(path))
+    x, y = np.random.default_rng(1).uniform(0, 10, (2, 100))
+    for result, expected in zip(restored.drop(x, y, 20.0, 30.0), surface.drop(x, y, 20.0, 30.0)):
+        np.testing.assert_array_equal(result, expected)
+
+def test_cluster_vertices_merge_close_vertices_and_drop_collapsed_triangles():
+    vertices, triangles = grid_mesh(lambda x, y: 0.1 * x, resolution=40)
+    merged, kept = snap_core.cluster_vertices(vertices, triangles, 1.0)
+    assert len(merged) < len(vertices) and 0 < len(kept) < len(triangles)
+    assert kept.max() < len(merged)
+    assert np.all((kept[:, 0] != kept[:, 1]) & (kept[:, 1] != kept[:, 2]) & (kept[:, 0] != kept[:, 2]))
+    np.testing.assert_allclose(merged[:, 2], 0.1 * merged[:, 0])
+
+    merged, kept = snap_core.cluster_vertices(vertices, triangles, 1e-3)
+    assert len(merged) == len(vertices) and len(kept) == len(triangles)
+
+def test_stack_supports_settles_bottom_up():
+    boxes = np.array([box(0, 0, 3, 1, 1, 4), box(0, 0, 0, 1, 1, 1), box(5, 5, 0, 6, 6, 1)])
+    supports, rows = snap_core.stack_supports(boxes, [0.0, 0.0, np.nan], 10.0, 0.0)
+    np.testing.assert_array_equal(supports[:2], [1.0, 0.0])
+    assert np.isnan(supports[2])
+    np.testing.assert_array_equal(rows, [1, -1, -1])
+
+def test_stack_supports_uses_settled_boxes():
+    settled = np.array([box(0, 0, 0, 1, 1, 1), box(5, 5, 2, 6, 6, 3)])
+    boxes = np.array([box(0.2, 0.2, 0, 0.8, 0.8, 0.5), box(5.2, 5.2, 0, 5.8, 5.8, 0.5)])
+    supports, rows = snap_core.stack_supports(boxes, [0.0, 0.0], 10.0, 0.0, settled)
+    np.testing.assert_array_equal(supports, [1.0, 3.0])
+    np.testing.assert_array_equal(rows, [2, 3])
+
+def test_sweep_and_prune_matches_brute_force():
+    rng = np.random.default_rng(2)
+    low = rng.uniform(0, 20, (300, 3))
+    boxes = np.hstack((low, low + rng.uniform(0.5, 2, (300, 3))))
+    active = rng.random(300) < 0.3
+
+    overlap = ((boxes[:, None, 0] < boxes[None, :, 3]) & (boxes[None, :, 0] < boxes[:, None, 3])
+               & (boxes[:, None, 1] < boxes[None, :, 4]) & (boxes[None, :, 1] < boxes[:, None, 4]))
+    overlap = np.triu(overlap, 1) & (active[:, None] | active[None, :])
+    assert pair_set(snap_core.sweep_and_prune(boxes, active)) == pair_set(np.nonzero(overlap))
+
+def test_sweep_and_prune_skips_touching_boxes():
+    boxes = np.array([box(0, 0, 0, 1, 1, 1), box(1, 0, 0, 2, 1, 1), box(0, 1, 0, 1, 2, 1)])
+    assert pair_set(snap_core.sweep_and_prune(boxes)) == set()
+
+def test_resolve_overlaps_leaves_touching_neighbours():
+    boxes = np.array([box(0, 0, 0, 1, 1, 1), box(1, 0, 0, 2, 1, 1)])
+    first, second = cube_mesh(), cube_mesh(x=1)
+    points, owners = np.vstack((first[0], second[0])), np.repeat([0, 1], 8)
+    surfaces = {0: (snap_core.TriangleSurface(*first), 0.0), 1: (snap_core.TriangleSurface(*second), 0.0)}
+    lifts = snap_core.resolve_overlaps(boxes, [True, True], (np.array([0]), np.array([1])), points, owners, surfaces)
+    np.testing.assert_array_equal(lifts, [0, 0])
+
+def test_resolve_overlaps_stacks_boxes_on_the_same_floor():
+    boxes = np.array([box(0, 0, 0, 1, 1, 1)] * 3)
+    points, owners = box_points(boxes)
+    lifts = snap_core.resolve_overlaps(boxes, [True] * 3, snap_core.sweep_and_prune(boxes), points, owners, {})
+    np.testing.assert_array_equal(np.sort(lifts), [0, 1, 2])
+
+def test_resolve_overlaps_lifts_onto_intersected_surface_only():
+    slab = cube_mesh(size=2.0)
+    cube = cube_mesh(x=1.5, y=1.5, z=1.5)
+    boxes = np.array([box(0, 0, 0, 2, 2, 2), box(1.5, 1.5, 1.5, 2.5, 2.5, 2.5)])
+    points, owners = np.vstack((slab[0], cube[0])), np.repeat([0, 1], 8)
+    surfaces = {0: (snap_core.TriangleSurface(*slab), 0.0)}
+    pairs = snap_core.sweep_and_prune(boxes)
+    lifts = snap_core.resolve_overlaps(boxes, [False, True], pairs, points, owners, surfaces)
+    np.testing.assert_allclose(lifts, [0, 0.5])
+
+    # The same cube resting on top of the slab is left alone
+    boxes[1, [2, 5]] += 0.5
+    points[8:, 2] += 0.5
+    lifts = snap_core.resolve_overlaps(boxes, [False, True], pairs, points, owners, surfaces)
+    np.testing.assert_allclose(lifts, [0, 0])
+
+def test_resolve_overlaps_separates_crossed_planks():
+    unit, triangles = cube_mesh()
+    boxes = np.array([box(0, 4, 0, 10, 6, 1), box(4, 0, 0, 6, 10, 1)])
+    meshes = [unit * (row[3:] - row[:3]) + row[:3] for row in boxes]
+    points, owners = np.vstack(meshes), np.repeat([0, 1], 8)
+    surfaces = {row: (snap_core.TriangleSurface(mesh, triangles), 0.0) for row, mesh in enumerate(meshes)}
+    pairs = snap_core.sweep_and_prune(boxes)
+
+    # No corner of either plank lies inside the other's footprint
+    for movable in ([True, True], [False, True], [True, False]):
+        lifts = snap_core.resolve_overlaps(boxes, movable, pairs, points, owners, surfaces)
+        np.testing.assert_allclose(np.sort(lifts), [0, 1])
+    np.testing.assert_allclose(snap_core.resolve_overlaps(boxes, [True, True], pairs, points, owners, {}), [0, 1])
+
+def test_support_points_keep_the_lowest_vertex():
+    vertices = np.random.default_rng(3).normal(size=(2000, 3))
+    kept = vertices[snap_core.support_points(vertices)]
+    assert len(kept) < len(vertices)
+    assert kept[:, 2].min() == vertices[:, 2].min()
+
+def test_contact_supports_rest_the_closest_point_on_the_floor():
+    surfaces = {"slope": snap_core.TriangleSurface(*grid_mesh(lambda x, y: 0.2 * x))}
+    points = [[2, 2, 1.5], [3, 3, 1.0], [50, 50, 1.0]]
+    supports, floors, triangles = snap_core.contact_supports(surfaces, [["slope"], ["slope"]], points, [0, 0, 1],
+                                                             [1.0, 1.0], 5.0, 10.0)
+    # The point at x=3 is 0.4 above the slope, closer than the one at x=2
+    np.testing.assert_allclose(supports[0], 0.6)
+    assert np.isnan(supports[1])
+    assert floors == ["slope", None]
+    assert triangles[0] >= 0 and triangles[1] == -1
+
+def test_drop_points_keep_the_highest_hit_per_point():
+    surfaces = {"ground": snap_core.TriangleSurface(*grid_mesh(lambda x, y: np.zeros_like(x))),
+                "crate": snap_core.TriangleSurface(*cube_mesh(2, 2))}
+    points = [[2.5, 2.5, 0], [5, 5, 0], [2.5, 2.5, 0]]
+    heights, floors, _ = snap_core.drop_points(surfaces, [["ground", "crate"], ["ground"]], points, [0, 0, 1],
+                                               [5.0, 5.0], 10.0)
+    np.testing.assert_allclose(heights, [1, 0, 0])
+    assert floors == ["crate", "ground", "ground"]
+
+def test_best_per_owner_skips_nan():
+    values = [np.nan, 3.0, 1.0, 2.0, np.nan]
+    owners = np.array([0, 0, 0, 1, 2])
+    np.testing.assert_array_equal(snap_core.best_per_owner(values, owners, 4), [2, 3, -1, -1])
+    np.testing.assert_array_equal(snap_core.best_per_owner(values, owners, 4, largest=True), [1, 3, -1, -1])
+
+def test_footprint_supports_combine_hits_over_the_footprint():
+    surfaces = {"slope": snap_core.TriangleSurface(*grid_mesh(lambda x, y: 0.2 * x))}
+    boxes = [box(2, 2, 1, 4, 4, 2), box(50, 50, 1, 51, 51, 2)]
+    candidates = [["slope"], ["slope"]]
+
+    supports, floors, _, normals = snap_core.footprint_supports(surfaces, candidates, boxes, 4, 10.0)
+    np.testing.assert_allclose(supports[0], 0.2 * 3.75)
+    assert np.isnan(supports[1]) and floors == ["slope", None]
+    assert np.isnan(normals).all()
+
+    supports, _, _, normals = snap_core.footprint_supports(surfaces, candidates, boxes, 4, 10.0, 'PLANE', level=False)
+    np.testing.assert_allclose(supports[0], 0.6)
+    np.testing.assert_allclose(normals[0], np.array([-0.2, 0, 1]) / np.hypot(1, 0.2), atol=1e-9)
+    supports, _, _, _ = snap_core.footprint_supports(surfaces, candidates, boxes, 4, 10.0, 'PLANE')
+    np.testing.assert_allclose(supports[0], 0.8)
+
+def test_grid_clusters_label_points_per_cell():
+    labels = snap_core.grid_clusters([[0.1, 0.1], [0.9, 0.4], [1.5, 0.2], [-0.5, 0.5]], 1.0)
+    assert labels[0] == labels[1]
+    assert len({labels[0], labels[2], labels[3]}) == 3
+
+def test_kmeans_clusters_separate_distant_groups():
+    rng = np.random.default_rng(4)
+    xy = np.vstack((rng.random((40, 2)), rng.random((40, 2)) + 10))
+    labels = snap_core.kmeans_clusters(xy, 2, rng=rng)
+    assert len(set(labels[:40].tolist())) == 1 and len(set(labels[40:].tolist())) == 1
+    assert labels[0] != labels[40]
+    np.testing.assert_array_equal(snap_core.kmeans_clusters(xy, 1), np.zeros(80))
+
+def test_landing_heights_rest_on_supports():
+    np.testing.assert_allclose(snap_core.landing_heights(np.array([1.0, 2.0]), np.array([0.5, 1.0]), 0.1),
+                               [1.6, 3.1])